@@ -0,0 +1,307 @@
+# Benchmarks simplify, equivalent and neighbors on seeded random circuits.
+#
+#     python bench.py --inputs 4 8 --depth 4 6 --output before.json
+#     python bench.py --inputs 4 8 --depth 4 6 --baseline before.json
+#
+# Every combination of --inputs, --depth, --redundancy and --mix is a case
+# of --count circuits. Each operation is timed on every circuit of a case
+# --repeat times, then run again under tracemalloc for its peak memory.
+# Results are printed as a table and written as JSON with --output;
+# --baseline compares them with an earlier run and lists the cases that got
+# slower or worse. Times are medians over the repeats, and a slowdown only
+# counts when it is above both --tolerance and --floor seconds, so timer
+# noise on fast cases is not reported.
+
+import argparse
+import json
+import platform
+import signal
+from statistics import median
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from random import Random
+from time import perf_counter
+
+from solution import And, Constant, Not, Or, Variable, rule_index
+
+# Gate weights of the default mix. Leaves are inputs or constants and can
+# appear above the bottom level, so circuits are not all full trees.
+MIX = {"and": 3, "or": 3, "not": 2, "input": 1, "constant": 0.1}
+
+# Engines and the options they run with. Greedy runs modulo AC, where its
+# plateaus are far smaller.
+ENGINES = {
+    "greedy": {"ac": True},
+    "best-first": {"expansions": 2000},
+    "egraph": {"limit": 5000},
+    "two-level": {},
+}
+
+
+class Timeout(Exception):
+    pass
+
+
+def random_term(random, inputs, depth, mix=MIX, redundancy=0.0, built=None):
+    # A random circuit over inputs x0 ... at most depth deep. mix weights
+    # the kinds of node; with probability redundancy a gate is instead a
+    # copy of one already built, so circuits repeat structure the way real
+    # netlists do.
+    if built is None:
+        built = []
+    kinds = list(mix) if depth > 1 else ["input", "constant"]
+    kind = random.choices(kinds, [mix[kind] for kind in kinds])[0]
+    if kind == "input":
+        return Variable(f"x{random.randrange(inputs)}")
+    if kind == "constant":
+        return Constant(random.random() < 0.5)
+    if built and random.random() < redundancy:
+        candidates = [term for term in built if term.depth() < depth]
+        if candidates:
+            return random.choice(candidates)
+    if kind == "not":
+        term = Not(random_term(random, inputs, depth - 1, mix, redundancy,
+                               built))
+    else:
+        cls = And if kind == "and" else Or
+        term = cls(random_term(random, inputs, depth - 1, mix, redundancy,
+                               built),
+                   random_term(random, inputs, depth - 1, mix, redundancy,
+                               built))
+    built.append(term)
+    return term
+
+
+def random_terms(seed, count, inputs, depth, mix=MIX, redundancy=0.0):
+    random = Random(seed)
+    return [random_term(random, inputs, depth, mix, redundancy)
+            for _ in range(count)]
+
+
+def operations(terms, engines, seed):
+    # (name, engine, function) for everything measured on terms. equivalent
+    # compares each term with a random neighbor, which is equal but not
+    # identical.
+    random = Random(seed)
+    others = {}
+    for term in terms:
+        neighbors = sorted(term.neighbors(), key=str)
+        others[term] = random.choice(neighbors) if neighbors else term
+    found = [("neighbors", None, lambda term: term.neighbors()),
+             ("equivalent", None, lambda term: term.equivalent(others[term]))]
+    for engine in engines:
+        options = ENGINES.get(engine, {})
+        found.append(("simplify", engine,
+                      lambda term, engine=engine, options=options:
+                      term.simplify(engine=engine, **options)))
+    return found
+
+
+def alarm(signum, frame):
+    raise Timeout()
+
+
+def run(function, terms, timeout):
+    # Latency of each call, its results and how many calls timed out. The
+    # timeout needs SIGALRM and is ignored where there is none.
+    limited = timeout and hasattr(signal, "setitimer")
+    if limited:
+        previous = signal.signal(signal.SIGALRM, alarm)
+    latencies = []
+    results = []
+    timeouts = 0
+    try:
+        for term in terms:
+            start = perf_counter()
+            try:
+                if limited:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                result = function(term)
+            except Timeout:
+                timeouts += 1
+                result = term
+            finally:
+                if limited:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            latencies.append(perf_counter() - start)
+            results.append(result)
+    finally:
+        if limited:
+            signal.signal(signal.SIGALRM, previous)
+    return latencies, results, timeouts
+
+
+def peak_memory(function, terms, timeout):
+    tracemalloc.start()
+    try:
+        run(function, terms, timeout)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(case, terms, name, engine, function, timeout, memory, repeat=1):
+    # Latencies are pooled over the repeats, results and timeouts are those
+    # of the first
+    runs = [run(function, terms, timeout) for _ in range(repeat)]
+    _, results, timeouts = runs[0]
+    latencies = [latency for run_latencies, _, _ in runs
+                 for latency in run_latencies]
+    totals = [sum(run_latencies) for run_latencies, _, _ in runs]
+    total = median(totals)
+    measured = {
+        "case": case,
+        "operation": name,
+        "engine": engine,
+        "count": len(terms),
+        "seconds": total,
+        "runs": totals,
+        "throughput": len(terms) / total if total else None,
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies),
+        "timeouts": timeouts,
+        "memory": peak_memory(function, terms, timeout) if memory else None,
+        "cost": sum(term.cost() for term in terms),
+    }
+    if name == "simplify":
+        measured["result"] = sum(result.cost() for result in results)
+    return measured
+
+
+def key(measured):
+    return json.dumps([measured["case"], measured["operation"],
+                       measured["engine"]], sort_keys=True)
+
+
+def compare(results, baseline, tolerance, floor=0.0):
+    # Lines describing every result that is slower than the same case in
+    # baseline by more than tolerance and more than floor seconds, or
+    # simplifies to a higher cost
+    before = {key(measured): measured for measured in baseline["results"]}
+    lines = []
+    for measured in results:
+        old = before.get(key(measured))
+        if old is None:
+            continue
+        label = label_of(measured)
+        if (measured["seconds"] > old["seconds"] * (1 + tolerance) and
+                measured["seconds"] - old["seconds"] > floor):
+            lines.append(f"{label}: {old['seconds']:.6f}s -> "
+                         f"{measured['seconds']:.6f}s")
+        if measured.get("result", 0) > old.get("result", 0):
+            lines.append(f"{label}: cost {old['result']} -> "
+                         f"{measured['result']}")
+    return lines
+
+
+def label_of(measured):
+    case = measured["case"]
+    operation = measured["operation"]
+    if measured["engine"] is not None:
+        operation += f" {measured['engine']}"
+    mix = ",".join(f"{kind}={weight:g}" for kind, weight
+                   in case["mix"].items())
+    return (f"{operation} inputs={case['inputs']} depth={case['depth']} "
+            f"redundancy={case['redundancy']} mix={mix}")
+
+
+def report(measured, file=sys.stdout):
+    memory = measured["memory"]
+    memory = "-" if memory is None else f"{memory / 1024:.0f}KiB"
+    cost = f"{measured['cost']}"
+    if "result" in measured:
+        cost += f"->{measured['result']}"
+    throughput = measured["throughput"]
+    throughput = "-" if throughput is None else f"{throughput:.1f}/s"
+    print(f"{label_of(measured)}  {throughput}  p50 {measured['p50']:.6f}s "
+          f"p90 {measured['p90']:.6f}s p99 {measured['p99']:.6f}s  "
+          f"{memory}  cost {cost}  timeouts {measured['timeouts']}",
+          file=file)
+
+
+def parse_mix(text):
+    # "and=3,or=3,not=2,input=1,constant=0.1", unnamed kinds weigh 0
+    mix = dict.fromkeys(MIX, 0.0)
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        if kind not in mix:
+            raise argparse.ArgumentTypeError(f"unknown gate kind {kind!r}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simplifier "
+                                     "on seeded random circuits.")
+    parser.add_argument("--inputs", type=int, nargs="+", default=[4])
+    parser.add_argument("--depth", type=int, nargs="+", default=[4])
+    parser.add_argument("--redundancy", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--mix", type=parse_mix, nargs="+", default=[MIX])
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed runs per operation, the median is kept")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES),
+                        choices=list(ENGINES))
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds allowed per call, 0 for no limit")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown reported against the baseline")
+    parser.add_argument("--floor", type=float, default=0.01,
+                        help="seconds a slowdown must also exceed")
+    args = parser.parse_args(argv)
+
+    results = []
+    for inputs in args.inputs:
+        for depth in args.depth:
+            for redundancy in args.redundancy:
+                for mix in args.mix:
+                    case = {"inputs": inputs, "depth": depth,
+                            "redundancy": redundancy, "mix": mix,
+                            "seed": args.seed}
+                    terms = random_terms(args.seed, args.count, inputs,
+                                         depth, mix, redundancy)
+                    for name, engine, function in operations(
+                            terms, args.engines, args.seed):
+                        measured = measure(case, terms, name, engine,
+                                           function, args.timeout,
+                                           args.memory, args.repeat)
+                        report(measured)
+                        results.append(measured)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "rules": rule_index().version,
+                "engines": {engine: ENGINES[engine]
+                            for engine in args.engines},
+                "results": results,
+            }, file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance,
+                                  args.floor)
+        for line in regressions:
+            print(f"regression: {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -76,4 +76,413 @@ def simplify5():
     if not simplified.equivalent(expr):
         raise check50.Failure()
     if simplified.cost() > 8:
-        raise check50.Failure()
\ No newline at end of file
+        raise check50.Failure()
+
+@check50.check(exists)
+def portfolio():
+    """the portfolio engine is as good as its best strategy"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.And(a, g.Or(b, g.Or(c, c)))
+    simplified = expr.simplify(engine="portfolio")
+    if not simplified.equivalent(expr):
+        raise check50.Failure()
+    if simplified.cost() > 5:
+        raise check50.Failure()
+    expr = g.Or(g.And(a, a), b)
+    simplified = expr.simplify(engine="portfolio", strategies=[("greedy", {})])
+    if not simplified.equivalent(expr):
+        raise check50.Failure()
+    if simplified.cost() > 3:
+        raise check50.Failure()
+
+@check50.check(exists)
+def portfolio_patience():
+    """a portfolio run only gives up while another run is ahead"""
+    import multiprocessing
+    g = check50.py.import_("gates.py")
+    best = multiprocessing.Value("q", 7)
+    run = g.Race(0, best, multiprocessing.Queue(), 0, 1, 7)
+    for _ in range(3):
+        run.expand(1, 1)
+    best.value = 5
+    try:
+        run.expand(1, 1)
+    except g.Beaten:
+        pass
+    else:
+        raise check50.Failure()
+
+@check50.check(exists)
+def two_level_wide():
+    """two-level minimization leaves terms with many inputs alone"""
+    g = check50.py.import_("gates.py")
+    expr = g.Variable("x0")
+    for i in range(1, 50):
+        expr = g.Or(expr, g.Variable(f"x{i}"))
+    if expr.simplify(engine="two-level") != expr:
+        raise check50.Failure()
+    try:
+        g.minimize(expr)
+    except ValueError:
+        pass
+    else:
+        raise check50.Failure()
+
+@check50.check(exists)
+def equivalent_deep():
+    """equivalence of terms 1500 gates deep"""
+    g = check50.py.import_("gates.py")
+    names = [f"x{i}" for i in range(1500)]
+    left = g.Variable(names[-1])
+    right = g.Not(g.Variable(names[-1]))
+    for name in reversed(names[:-1]):
+        left = g.Or(g.Variable(name), left)
+        right = g.And(g.Not(g.Variable(name)), right)
+    right = g.Not(right)
+    if not left.equivalent(right):
+        raise check50.Failure()
+    if left.equivalent(g.Or(right, g.Variable("y"))):
+        raise check50.Failure()
+
+@check50.check(exists)
+def equivalent_methods():
+    """truth tables, BDDs and SAT agree on equivalence"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    tests = [
+        (g.Not(g.And(a, b)), g.Or(g.Not(a), g.Not(b)), True),
+        (g.And(a, g.Or(b, c)), g.Or(g.And(a, b), g.And(a, c)), True),
+        (g.Or(a, g.And(b, c)), g.And(g.Or(a, b), g.Or(a, c)), True),
+        (g.And(a, g.Or(b, c)), g.Or(g.And(a, b), c), False),
+        (g.Or(g.And(a, g.Not(b)), g.And(g.Not(a), b)), g.Or(a, b), False),
+    ]
+    for left, right, expected in tests:
+        for method in ["table", "bdd", "sat"]:
+            if left.equivalent(right, method, vectors=0) != expected:
+                raise check50.Failure()
+            found = left.counterexample(right, method, vectors=0)
+            if found is not None and (left.evaluate(found) ==
+                                      right.evaluate(found)):
+                raise check50.Failure()
+
+@check50.check(exists)
+def round_trip():
+    """terms survive parse, encode and dump"""
+    import io
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    terms = [g.Not(g.And(g.Or(a, g.Constant(False)), g.Not(b))),
+             g.Or(g.And(a, b), g.And(g.Or(b, c), g.Constant(True)))]
+    for term in terms:
+        if g.parse(str(term)) != term or g.decode(term.encode()) != term:
+            raise check50.Failure()
+    file = io.BytesIO()
+    g.dump(terms, file)
+    file.seek(0)
+    if list(g.load(file)) != terms:
+        raise check50.Failure()
+
+@check50.check(exists)
+def optimal():
+    """library circuits are equivalent and no costlier"""
+    g = check50.py.import_("gates.py")
+    a, b = g.Variable("a"), g.Variable("b")
+    expr = g.Or(g.And(a, g.Not(b)), g.And(g.Not(a), b))
+    circuit = g.optimal(expr)
+    if not circuit.equivalent(expr) or circuit.cost() > 8:
+        raise check50.Failure()
+
+@check50.check(exists)
+def interned():
+    """structurally equal terms are the same object"""
+    g = check50.py.import_("gates.py")
+    if g.And(g.Variable("a"), g.Constant(1)) is not g.And(g.Variable("a"),
+                                                          g.Constant(True)):
+        raise check50.Failure()
+    if g.Constant(2) is not g.Constant(True) or g.Constant(2).value is not True:
+        raise check50.Failure()
+    if g.Constant(0) is not g.Constant(False):
+        raise check50.Failure()
+
+@check50.check(exists)
+def egraph():
+    """equality saturation simplifies within its limits"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    simplified = expr.simplify(engine="egraph", limit=1000)
+    if not simplified.equivalent(expr) or simplified.cost() > 5:
+        raise check50.Failure()
+    for options in [{"iterations": 0}, {"limit": 3}]:
+        simplified = expr.simplify(engine="egraph", **options)
+        if not simplified.equivalent(expr) or simplified.cost() > expr.cost():
+            raise check50.Failure()
+
+@check50.check(exists)
+def search():
+    """best-first search reports why it stopped"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    tests = [({"expansions": 0}, "expansions"),
+             ({"memory": 1}, "memory"),
+             ({"expansions": None, "timeout": 0}, "timeout"),
+             ({"heuristic": lambda term: 5}, "bound")]
+    for budgets, reason in tests:
+        found = expr.search(**budgets)
+        if found.reason != reason or not found.term.equivalent(expr):
+            raise check50.Failure()
+    if expr.search(heuristic=lambda term: 5).term.cost() != 5:
+        raise check50.Failure()
+
+@check50.check(exists)
+def canonical():
+    """AC orbits share one canonical term"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    if g.Or(a, g.And(b, a)).canonical() is not g.Or(g.And(a, b), a).canonical():
+        raise check50.Failure()
+    if g.Or(g.Or(a, b), c).canonical() is not g.Or(a, g.Or(c, b)).canonical():
+        raise check50.Failure()
+    if g.Or(a, a).canonical() is not a:
+        raise check50.Failure()
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    for neighbor in expr.neighbors(ac=True):
+        if neighbor is not neighbor.canonical():
+            raise check50.Failure()
+        if not neighbor.equivalent(expr):
+            raise check50.Failure()
+    if expr.simplify(ac=True).cost() > 5:
+        raise check50.Failure()
+
+@check50.check(exists)
+def simplify_many():
+    """batch simplification keeps input order"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    first = g.And(g.Or(a, b), g.Or(a, c))
+    second = g.Or(g.Or(a, b), g.Or(a, b))
+    terms = [first, second, first, g.Not(g.Not(c))]
+    results = g.simplify_many(terms, workers=2, chunksize=1, ac=True)
+    if len(results) != len(terms) or results[0] is not results[2]:
+        raise check50.Failure()
+    for term, result in zip(terms, results):
+        if not result.equivalent(term) or result.cost() > term.cost():
+            raise check50.Failure()
+    unordered = dict(g.simplify_many(terms, workers=2, ordered=False, ac=True))
+    if [unordered[i] for i in range(len(terms))] != results:
+        raise check50.Failure()
+
+@check50.check(exists)
+def compiled():
+    """compiled terms evaluate like the terms"""
+    import itertools
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.Or(g.And(a, g.Not(b)), g.And(c, g.Constant(True)))
+    function = expr.compile()
+    if function.inputs != ["a", "b", "c"] or expr.compile() is not function:
+        raise check50.Failure()
+    for row in itertools.product([False, True], repeat=3):
+        if function(*row) != expr.evaluate(dict(zip(function.inputs, row))):
+            raise check50.Failure()
+
+@check50.check(exists)
+def simplify_cache():
+    """cached results are never costlier than the input"""
+    import os
+    import tempfile
+    g = check50.py.import_("gates.py")
+    a, b = g.Variable("a"), g.Variable("b")
+    expr = g.Or(g.And(a, b), g.Or(g.And(b, a), g.And(a, b)))
+    with tempfile.TemporaryDirectory() as directory:
+        with g.SimplifyCache(os.path.join(directory, "cache.db")) as cache:
+            expr.simplify(engine="best-first", expansions=0, cache=cache)
+            for term in [g.And(a, b), g.And(b, a), expr]:
+                result = term.simplify(engine="best-first", expansions=0,
+                                       cache=cache)
+                if not result.equivalent(term) or result.cost() > 3:
+                    raise check50.Failure()
+            simplified = g.Or(expr, a).simplify(memo=cache, ac=True)
+            if simplified is not a:
+                raise check50.Failure()
+            if g.And(b, a).simplify(memo=cache).cost() > 3:
+                raise check50.Failure()
+            if not g.cacheable("greedy", {"ac": True}):
+                raise check50.Failure()
+            if g.cacheable("best-first", {"timeout": 1}):
+                raise check50.Failure()
+            if g.cacheable("best-first", {"heuristic": lambda term: 1}):
+                raise check50.Failure()
+
+@check50.check(exists)
+def deep_terms():
+    """terms 100000 gates deep can be printed, compared and pickled"""
+    import pickle
+    g = check50.py.import_("gates.py")
+    expr = g.Variable("x")
+    for i in range(100000):
+        expr = g.Not(expr) if i % 2 else g.And(expr, g.Variable(f"y{i % 7}"))
+    if expr.depth() != 100001 or g.parse(str(expr)) is not expr:
+        raise check50.Failure()
+    if pickle.loads(pickle.dumps(expr)) is not expr:
+        raise check50.Failure()
+    shared = g.Variable("a")
+    for _ in range(40):
+        shared = g.And(shared, g.Not(shared))
+    if pickle.loads(pickle.dumps(shared)) is not shared:
+        raise check50.Failure()
+
+@check50.check(exists)
+def stats():
+    """simplify records its work and each improvement"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    improvements = []
+    stats = g.Stats(lambda term, cost: improvements.append(cost))
+    result = expr.simplify(engine="best-first", expansions=200, stats=stats)
+    if stats.expansions != 200 or stats.explored < stats.frontier:
+        raise check50.Failure()
+    if sum(stats.hits.values()) > sum(stats.attempts.values()) or not stats.hits:
+        raise check50.Failure()
+    if [cost for _, cost in stats.trajectory] != improvements:
+        raise check50.Failure()
+    if improvements[-1] != result.cost():
+        raise check50.Failure()
+    stats = g.Stats()
+    result = g.Or(g.And(a, a), g.Or(b, b)).simplify(ac=True, stats=stats)
+    costs = [cost for _, cost in stats.trajectory]
+    if costs != sorted(costs, reverse=True) or costs[-1] != result.cost():
+        raise check50.Failure()
+
+@check50.check(exists)
+def iter_neighbors():
+    """lazy neighbors carry their rewrite positions"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    found = list(expr.iter_neighbors())
+    if {neighbor for _, neighbor in found} != expr.neighbors():
+        raise check50.Failure()
+    index = g.rule_index()
+    for position, neighbor in found:
+        subterm = expr
+        for i in position:
+            subterm = subterm.children[i]
+        if neighbor not in {expr.replace(position, replacement) for
+                            replacement in subterm.replacements(index)}:
+            raise check50.Failure()
+    if list(expr.iter_neighbors(below=expr.cost())):
+        raise check50.Failure()
+    expr = g.Or(g.And(a, a), b)
+    for _, neighbor in expr.iter_neighbors(below=expr.cost()):
+        if neighbor.cost() >= expr.cost():
+            raise check50.Failure()
+
+@check50.check(exists)
+def compiled_rules():
+    """compiled rules rewrite like match and substitute"""
+    g = check50.py.import_("gates.py")
+    a, b = g.Variable("a"), g.Variable("b")
+    leaves = [a, b, g.Constant(False), g.Constant(True)]
+    terms = list(leaves)
+    for left in leaves:
+        terms.append(g.Not(left))
+        for right in leaves + [g.Not(a), g.And(a, b), g.Or(b, a)]:
+            terms.extend([g.And(left, right), g.Or(right, left)])
+    index = g.rule_index()
+    for rule in index.rules:
+        pattern, replacement = rule
+        for term in terms:
+            variables = {}
+            expected = None
+            if pattern.match(term, variables):
+                expected = replacement.substitute(variables)
+            if index.compiled[rule](term) is not expected:
+                raise check50.Failure()
+
+@check50.check(exists)
+def simplify_memo():
+    """the memo reuses results and evicts the least recently used"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    memo = g.SimplifyMemo(size=2)
+    memo.put(a, "setting", a)
+    memo.put(b, "setting", b)
+    memo.get(a, "setting")
+    memo.put(c, "setting", c)
+    if len(memo) != 2 or memo.get(b, "setting") is not None:
+        raise check50.Failure()
+    if memo.get(a, "setting") is not a or memo.get(a, "other") is not None:
+        raise check50.Failure()
+    memo = g.SimplifyMemo()
+    expr = g.And(g.Or(a, b), g.Or(a, c))
+    first = expr.simplify(ac=True, memo=memo)
+    if len(memo) == 0 or expr.simplify(ac=True, memo=memo) is not first:
+        raise check50.Failure()
+    if first.cost() > 5 or not first.equivalent(expr):
+        raise check50.Failure()
+
+@check50.check(exists)
+def shared_subexpressions():
+    """shared logic is counted, named and merged once"""
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    shared = g.And(a, b)
+    expr = g.Or(g.And(shared, c), g.And(shared, g.Not(c)))
+    if expr.cost() != 12 or expr.dag_cost() != 8:
+        raise check50.Failure()
+    if g.shared_cost([expr, shared]) != 8:
+        raise check50.Failure()
+    assignments, outputs = g.netlist([expr, shared])
+    if assignments != [("n0", shared)] or outputs[1] != g.Variable("n0"):
+        raise check50.Failure()
+    merged = g.merge_equivalent([g.And(a, b), g.Or(g.And(b, a), c)])
+    if merged[1].children[0] is not merged[0]:
+        raise check50.Failure()
+    outputs = g.simplify_outputs([expr, shared, g.Or(g.And(b, a), c)], ac=True)
+    for before, after in zip([expr, shared, g.Or(g.And(b, a), c)], outputs):
+        if not after.equivalent(before):
+            raise check50.Failure()
+    if g.shared_cost(outputs) > 5:
+        raise check50.Failure()
+
+@check50.check(exists)
+def node_table():
+    """node tables hold terms without losing or duplicating nodes"""
+    import io
+    g = check50.py.import_("gates.py")
+    a, b, c = g.Variable("a"), g.Variable("b"), g.Variable("c")
+    shared = g.And(a, b)
+    terms = [g.Or(g.And(shared, c), g.And(shared, g.Not(c))), shared,
+             g.Or(g.Constant(True), g.Not(g.Not(a)))]
+    table, roots = g.node_table(terms)
+    if [table.term(root) for root in roots] != terms:
+        raise check50.Failure()
+    if table.dag_cost(roots) != g.shared_cost(terms):
+        raise check50.Failure()
+    file = io.BytesIO()
+    g.dump(terms, file)
+    file.seek(0)
+    loaded, roots = g.load_table(file)
+    if [loaded.term(root) for root in roots] != terms:
+        raise check50.Failure()
+    if hasattr(a, "__dict__"):
+        raise check50.Failure()
+
+@check50.check(exists)
+def portfolio_deadline():
+    """a portfolio returns by its deadline"""
+    import time
+    g = check50.py.import_("gates.py")
+    if g.PORTFOLIO_TIMEOUT is None:
+        raise check50.Failure()
+    expr = g.parse("!((x0 + x3) * (x2 * x1))")
+    start = time.monotonic()
+    simplified = expr.simplify(engine="portfolio", timeout=1)
+    if time.monotonic() - start > 5 or not simplified.equivalent(expr):
+        raise check50.Failure()
+    if simplified.cost() > expr.cost():
+        raise check50.Failure()
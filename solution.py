@@ -1,217 +1,2954 @@
-from abc import ABC, abstractmethod
-from copy import deepcopy
+from abc import ABC, ABCMeta, abstractmethod
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from hashlib import blake2b
+from io import BytesIO
+from heapq import heapify, heappop, heappush
+from itertools import count, permutations
 from pprint import pprint
+from queue import Empty
+import multiprocessing
+import os
+from random import Random
+from time import monotonic, perf_counter
+import re
+import sqlite3
+import struct
+from weakref import WeakValueDictionary
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Above this many inputs truth tables are packed into NumPy uint64 words
+# (when NumPy is available) instead of a single Python integer.
+PACKED_INPUTS = 16
+
+# Up to this many inputs two-level minimization is exact Quine-McCluskey,
+# above it an Espresso-style heuristic.
+EXACT_INPUTS = 8
+
+# Both build the whole truth table, so above this many inputs terms are not
+# minimized at all.
+TWO_LEVEL_INPUTS = 16
+
+# Above this many inputs equivalence is decided with BDDs rather than
+# truth tables.
+TABLE_INPUTS = 20
+
+# Random input vectors tried, all at once, before proving equivalence
+SIMULATION_VECTORS = 4096
+
+# Subterms with at most this many inputs can be replaced by an optimal
+# circuit from a precomputed library, read lazily from LIBRARY_PATH.
+LIBRARY_INPUTS = 4
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "optimal4.bin")
+
+# Terms up to this deep are evaluated and printed recursively, which is
+# fastest; deeper ones are traversed with explicit stacks.
+RECURSION_DEPTH = 200
+
+# Every structurally distinct term exists exactly once, so terms can be
+# shared freely between trees and compared by identity.
+_TERMS = WeakValueDictionary()
+
+
+class Interned(ABCMeta):
+    def __call__(cls, *args):
+        args = cls.normalize(*args)
+        key = (cls, args)
+        term = _TERMS.get(key)
+        if term is None:
+            term = super().__call__(*args)
+            _TERMS[key] = term
+        return term
+
+
+class Term(ABC, metaclass=Interned):
+    # Slots rather than a __dict__ keep each node small; __weakref__ lets
+    # _TERMS hold it
+    __slots__ = ("children", "_hash", "_fingerprint", "_canonical",
+                 "_compiled", "_dag_cost", "_cost", "_depth", "_inputs",
+                 "__weakref__")
 
-class Term(ABC):
     def __init__(self, children):
-        self.children = children
+        self.children = tuple(children)
+        self._hash = hash((type(self), self.args()))
+        self._fingerprint = None
+        self._canonical = None
+        self._compiled = None
+        self._dag_cost = None
+        # Size, depth and inputs never change, so they are computed once
+        # from the children's values.
+        self._cost = 1
+        self._depth = 1
+        self._inputs = frozenset()
+        for child in self.children:
+            self._cost += child._cost
+            self._depth = max(self._depth, child._depth + 1)
+            if not child._inputs <= self._inputs:
+                if self._inputs <= child._inputs:
+                    self._inputs = child._inputs
+                else:
+                    self._inputs = self._inputs | child._inputs
 
     def __eq__(self, other):
-        return isinstance(other, type(self)) and other.children == self.children
+        return self is other
 
-    @abstractmethod
     def __hash__(self):
-        pass
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # Gates pickle in the binary format of dump(), which is iterative and
+        # stores shared subterms once, so depth and sharing cost nothing
+        if not self.children:
+            return (type(self), self.args())
+        file = BytesIO()
+        dump([self], file)
+        return (undump, (file.getvalue(),))
+
+    @classmethod
+    def normalize(cls, *args):
+        # Constructor arguments as interned, so equal terms share a key
+        return args
+
+    def args(self):
+        return self.children
+
+    def rebuild(self, children):
+        if not self.children:
+            return self
+        return type(self)(*children)
 
     @abstractmethod
-    def __str__(self):
+    def pieces(self):
         pass
 
+    def __str__(self):
+        # Subclasses format shallow terms recursively themselves; this
+        # writes deep ones out left to right from an explicit stack
+        parts = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+            else:
+                stack.extend(reversed(item.pieces()))
+        return "".join(parts)
+
     def __repr__(self):
         return str(self)
 
     @abstractmethod
+    def token(self):
+        pass
+
+    def encode(self):
+        # Compact prefix form, e.g. "+ $a ! $b" for (a + !b); see decode()
+        tokens = []
+        stack = [self]
+        while stack:
+            term = stack.pop()
+            tokens.append(term.token())
+            stack.extend(reversed(term.children))
+        return " ".join(tokens)
+
+    @abstractmethod
+    def evaluate(self, variables):
+        pass
+
     def eval(self, variables):
+        if self._depth <= RECURSION_DEPTH:
+            return self.evaluate(variables)
+        values = {name: bool(value) for name, value in variables.items()}
+        return self.simulate(values, True)
+
+    @abstractmethod
+    def bitwise(self, args, values, full):
         pass
 
     def inputs(self):
-        inputs = set()
-        for child in self.children:
-            inputs = inputs | child.inputs()
-        return inputs
-
-    def equivalent(self, other):
-        def permute(n):
-            array = []
-            permutations = 2 ** n - 1
-            while (permutations >= 0):
-                binary = str(bin(permutations))[2:]
-                while (len(binary) < n):
-                    binary = "0" + binary
-                array.append([bool(int(a)) for a in binary])
-                permutations = permutations - 1
-            return array
-
-        inputs = list(self.inputs() | other.inputs())
-        permutations = permute(len(inputs))
-        for permutation in permutations:
-            variables = {}
-            for i in range(len(inputs)):
-                variables[inputs[i].name] = permutation[i]
-            if self.eval(variables) != other.eval(variables):
-                return False
-        return True
+        return self._inputs
+
+    def depth(self):
+        return self._depth
+
+    def postorder(self, cached=None, seen=None):
+        # Every distinct subterm once, children before their parents. With
+        # cached, subterms that already have that attribute computed are left
+        # out together with everything below them. seen, when given, is
+        # shared between calls so that several roots list each subterm once.
+        order = []
+        if seen is None:
+            seen = set()
+        stack = [(self, False)]
+        while stack:
+            term, expanded = stack.pop()
+            if expanded:
+                order.append(term)
+            elif term not in seen and (cached is None or
+                                       getattr(term, cached) is None):
+                seen.add(term)
+                stack.append((term, True))
+                for child in reversed(term.children):
+                    stack.append((child, False))
+        return order
+
+    def simulate(self, values, full):
+        # Evaluates every row of a truth table at once: values maps each
+        # variable name to a bit vector and full has every row bit set.
+        results = {}
+        for term in self.postorder():
+            args = [results[child] for child in term.children]
+            results[term] = term.bitwise(args, values, full)
+        return results[self]
+
+    def compile(self, vectorized=False):
+        # Generates a straight-line function taking the inputs positionally,
+        # in the sorted name order given by its inputs attribute. vectorized
+        # functions take NumPy boolean arrays and evaluate every row at once.
+        if self._compiled is None:
+            self._compiled = {}
+        if vectorized in self._compiled:
+            return self._compiled[vectorized]
+        if vectorized and numpy is None:
+            raise ImportError("vectorized evaluation requires NumPy")
+
+        names = sorted(variable.name for variable in self.inputs())
+        parameters = {name: f"x{i}" for i, name in enumerate(names)}
+        lines = [f"def evaluate({', '.join(parameters.values())}):"]
+        results = {}
+        for term in self.postorder():
+            if isinstance(term, Variable):
+                results[term] = parameters[term.name]
+                continue
+            args = [results[child] for child in term.children]
+            results[term] = f"t{len(results)}"
+            lines.append(f"    {results[term]} = "
+                         f"{term.expression(args, vectorized)}")
+        lines.append(f"    return {results[self]}")
+
+        namespace = {}
+        if vectorized:
+            namespace.update(logical_not=numpy.logical_not,
+                             logical_and=numpy.logical_and,
+                             logical_or=numpy.logical_or)
+        exec(compile("\n".join(lines), "<term>", "exec"), namespace)
+        function = namespace["evaluate"]
+        function.inputs = names
+        self._compiled[vectorized] = function
+        return function
+
+    def truth_table(self, names=None):
+        if names is None:
+            names = sorted(variable.name for variable in self.inputs())
+        vectors, full = bit_vectors(len(names), packed=False)
+        return self.simulate(dict(zip(names, vectors)), full)
+
+    def fingerprint(self):
+        # Digest of the structure that, unlike hash(), is the same in every
+        # process
+        for term in self.postorder("_fingerprint"):
+            digest = blake2b(type(term).__name__.encode(), digest_size=16)
+            if term.children:
+                for child in term.children:
+                    digest.update(child._fingerprint)
+            else:
+                digest.update(repr(term.args()).encode())
+            term._fingerprint = digest.digest()
+        return self._fingerprint
+
+    def canonical(self):
+        # Representative of the term's orbit under commutativity,
+        # associativity and idempotence of And and Or: chains are flattened,
+        # their operands deduplicated, ordered by fingerprint and regrouped
+        # to the left.
+        for term in self.postorder("_canonical"):
+            children = [child._canonical for child in term.children]
+            if isinstance(term, Binary):
+                term._canonical = chain(type(term), children)
+            else:
+                term._canonical = term.rebuild(children)
+                term._canonical._canonical = term._canonical
+        return self._canonical
+
+    def equivalent(self, other, method=None, **options):
+        return self.counterexample(other, method, **options) is None
+
+    def counterexample(self, other, method=None, vectors=SIMULATION_VECTORS,
+                       seed=0):
+        # An assignment of the inputs on which self and other differ, or
+        # None when they are equivalent. method is "table", "bdd" or "sat";
+        # by default truth tables up to TABLE_INPUTS inputs and BDDs above.
+        # Unless the truth table is no larger, random input vectors are
+        # simulated first and the proof only runs if none tells them apart.
+        names = sorted(variable.name
+                       for variable in self.inputs() | other.inputs())
+        if vectors and vectors < 1 << len(names):
+            generator = Random(seed)
+            values = {name: generator.getrandbits(vectors) for name in names}
+            full = (1 << vectors) - 1
+            difference = (self.simulate(values, full) ^
+                          other.simulate(values, full))
+            if difference:
+                row = first_row(difference)
+                return {name: bool(values[name] >> row & 1) for name in names}
+        if method is None:
+            method = "table" if len(names) <= TABLE_INPUTS else "bdd"
+        if method == "bdd":
+            bdd = BDD(variable_order([self, other]))
+            f, g = bdd.build(self), bdd.build(other)
+            return bdd.satisfy(bdd.ite(f, bdd.ite(g, 0, 1), g))
+        if method == "sat":
+            return miter(self, other)
+        if method != "table":
+            raise ValueError(f"unknown equivalence method {method!r}")
+        vectors, full = bit_vectors(len(names))
+        values = dict(zip(names, vectors))
+        difference = self.simulate(values, full) ^ other.simulate(values, full)
+        row = first_row(difference)
+        if row is None:
+            return None
+        return {name: bool(row >> i & 1) for i, name in enumerate(names)}
 
     def match(self, redex, variables):
-        if not isinstance(redex, type(self)):
-            return False
-        for i in range(len(self.children)):
-            if not self.children[i].match(redex.children[i], variables):
+        # Binds the variables of this pattern to the subterms of redex they
+        # stand for, returning whether the pattern matches
+        if self._depth <= RECURSION_DEPTH:
+            if not isinstance(redex, type(self)):
+                return False
+            for i in range(len(self.children)):
+                if not self.children[i].match(redex.children[i], variables):
+                    return False
+            return True
+        stack = [(self, redex)]
+        while stack:
+            pattern, term = stack.pop()
+            if isinstance(pattern, Variable):
+                if pattern.name not in variables:
+                    variables[pattern.name] = term
+                elif variables[pattern.name] is not term:
+                    return False
+            elif pattern.children:
+                if not isinstance(term, type(pattern)):
+                    return False
+                stack.extend(zip(pattern.children, term.children))
+            elif pattern is not term:
                 return False
         return True
 
     def substitute(self, variables):
-        result = deepcopy(self)
-        for i in range(len(result.children)):
-            result.children[i] = result.children[i].substitute(variables)
-        return result
+        if self._depth <= RECURSION_DEPTH:
+            return self.rebuild([child.substitute(variables)
+                                 for child in self.children])
+        results = {}
+        for term in self.postorder():
+            if isinstance(term, Variable):
+                results[term] = variables[term.name]
+            else:
+                results[term] = term.rebuild([results[child]
+                                              for child in term.children])
+        return results[self]
+
+    def neighbors(self, rules=None, ac=False, stats=None):
+        index = rule_index(rules)
+        if ac:
+            return ac_neighbors(self.canonical(), index, stats)
+        if self._depth <= RECURSION_DEPTH:
+            return self.rewrites(index, None, stats)
+
+        # Computed bottom-up, each subterm once; a subterm's neighbors are
+        # dropped as soon as all its parents have used them
+        order = self.postorder()
+        parents = {}
+        for term in order:
+            for child in set(term.children):
+                parents[child] = parents.get(child, 0) + 1
+        neighbors = {}
+        for term in order:
+            found = term.rewrites(index, [neighbors[child]
+                                          for child in term.children], stats)
+            for child in set(term.children):
+                parents[child] -= 1
+                if parents[child] == 0:
+                    del neighbors[child]
+            neighbors[term] = found
+
+        return neighbors[self]
+
+    def iter_neighbors(self, rules=None, ac=False, below=None, stats=None):
+        # Yields (position, neighbor) pairs one at a time, so callers that
+        # stop early never match the rest of the term. position is the path
+        # of child indices to the rewritten subterm, and only that path is
+        # rebuilt. With below, neighbors that do not cost less are skipped
+        # before they are built, as a rewrite changes the cost of the whole
+        # term by exactly as much as it changes the subterm's. Neighbors may
+        # repeat. Modulo AC the neighbors come from ac_neighbors(), all at
+        # once and without positions.
+        index = rule_index(rules)
+        if ac:
+            for neighbor in ac_neighbors(self.canonical(), index, stats):
+                if below is None or neighbor._cost < below:
+                    yield None, neighbor
+            return
+
+        # Shallowest subterms first, whose spines are the cheapest to
+        # rebuild. Paths are kept as (index, parent path) pairs until used,
+        # so that descending costs the same at any depth.
+        replacements = {}
+        queue = deque([(self, None)])
+        while queue:
+            term, path = queue.popleft()
+            found = replacements.get(term)
+            if found is None:
+                found = replacements[term] = term.replacements(index, stats)
+            position = None
+            for replacement in found:
+                if (below is None or
+                        self._cost - term._cost + replacement._cost < below):
+                    if position is None:
+                        position = []
+                        link = path
+                        while link is not None:
+                            position.append(link[0])
+                            link = link[1]
+                        position = tuple(reversed(position))
+                    yield position, self.replace(position, replacement)
+            for i in range(len(term.children)):
+                queue.append((term.children[i], (i, path)))
 
-    def neighbors(self):
-        neighbors = set()
+    def replace(self, position, term):
+        # This term with the subterm at position replaced by term
+        spine = [self]
+        for i in position[:-1]:
+            spine.append(spine[-1].children[i])
+        for parent, i in zip(reversed(spine), reversed(position)):
+            children = list(parent.children)
+            children[i] = term
+            term = parent.rebuild(children)
+        return term
 
-        for rule in RULES:
-            variables = {}
-            if rule[0].match(self, variables):
-                neighbor = rule[1].substitute(variables)
-                if neighbor is not None and neighbor not in neighbors:
-                    neighbors.add(neighbor)
+    def replacements(self, index, stats=None):
+        # Terms this one rewrites to in a single step at its root
+        found = set()
+        for rule in index.candidates(self):
+            if stats is None:
+                result = index.compiled[rule](self)
+                if result is not None:
+                    found.add(result)
+                continue
+            start = perf_counter()
+            result = index.compiled[rule](self)
+            if result is not None:
+                found.add(result)
+            stats.attempt(rule, int(result is not None),
+                          perf_counter() - start)
+        return found
 
+    def rewrites(self, index, inner, stats=None):
+        # Neighbors of this term given those of each of its children, which
+        # are computed recursively when inner is None
+        neighbors = self.replacements(index, stats)
+
+        # Only the spine from the rewritten child up to this node is rebuilt,
+        # the untouched siblings are shared with the original term.
         for i in range(len(self.children)):
-            for child_neighbor in self.children[i].neighbors():
-                neighbor = deepcopy(self)
-                neighbor.children[i] = child_neighbor
-                if neighbor not in neighbors:
-                    neighbors.add(neighbor)
+            if inner is None:
+                child_neighbors = self.children[i].rewrites(index, None, stats)
+            else:
+                child_neighbors = inner[i]
+            for child_neighbor in child_neighbors:
+                children = list(self.children)
+                children[i] = child_neighbor
+                neighbors.add(self.rebuild(children))
 
         return neighbors
 
     def cost(self):
-        c = 1
-        for child in self.children:
-            c += child.cost()
-        return c
-
-    def simplify(self):
-        state = deepcopy(self)
-        for i in range(len(state.children)):
-            state.children[i] = state.children[i].simplify()
-
-        frontier = {state}
-        best = state
-        explored = set()
-        while len(frontier) > 0:
-            state = frontier.pop()
-            explored.add(state)
-
-            for neighbor in state.neighbors():
-                if neighbor not in explored:
-                    if neighbor.cost() < best.cost():
-                        frontier = {neighbor}
-                        best = neighbor
-                        break
-                    else:
-                        frontier.add(neighbor)
+        return self._cost
+
+    def dag_cost(self):
+        # Gates and leaves counted once however often they are used, which
+        # is what a circuit built with shared subexpressions needs
+        if self._dag_cost is None:
+            self._dag_cost = len(self.postorder())
+        return self._dag_cost
+
+    def simplify(self, rules=None, engine="greedy", cache=None, stats=None,
+                 **options):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown simplify engine {engine!r}")
+        index = rule_index(rules)
+        if cache is None or not cacheable(engine, options):
+            return ENGINES[engine](self, index, stats=stats, **options)
+        setting = repr((index.version, engine,
+                        sorted((key, value) for key, value in options.items()
+                               if key != "memo")))
+        result = cache.get(self, setting)
+        if result is None:
+            result = ENGINES[engine](self, index, stats=stats, **options)
+            cache.put(self, setting, result)
+        return result
 
-        return best
+    def search(self, rules=None, **budgets):
+        return search(self, rule_index(rules), **budgets)
 
 
 class Constant(Term):
+    __slots__ = ("value",)
+
     def __init__(self, value):
-        super().__init__([])
         self.value = value
+        super().__init__([])
 
-    def __eq__(self, other):
-        return isinstance(other, Constant) and other.value == self.value
+    @classmethod
+    def normalize(cls, value):
+        return (bool(value),)
 
-    def __hash__(self):
-        return hash(self.value)
+    def args(self):
+        return (self.value,)
 
     def __str__(self):
         return str(int(self.value))
 
-    def eval(self, variables):
+    def pieces(self):
+        return [str(self)]
+
+    def token(self):
+        return str(int(self.value))
+
+    def evaluate(self, variables):
         return self.value
 
+    def bitwise(self, args, values, full):
+        return full if self.value else full ^ full
+
+    def clauses(self, literal, args):
+        return [[literal if self.value else -literal]]
+
+    def expression(self, args, vectorized):
+        return repr(self.value)
+
     def match(self, redex, variables):
-        return redex == self
+        return redex is self
 
 
 class Variable(Term):
+    __slots__ = ("name",)
+
     def __init__(self, name):
-        super().__init__([])
         self.name = name
+        super().__init__([])
+        self._inputs = frozenset([self])
 
-    def __eq__(self, other):
-        return isinstance(other, Variable) and other.name == self.name
-
-    def __hash__(self):
-        return hash(self.name)
+    def args(self):
+        return (self.name,)
 
     def __str__(self):
         return self.name
 
-    def eval(self, variables):
+    def pieces(self):
+        return [self.name]
+
+    def token(self):
+        return "$" + self.name
+
+    def evaluate(self, variables):
         return variables[self.name]
 
-    def inputs(self):
-        return {self}
+    def bitwise(self, args, values, full):
+        return values[self.name]
+
+    def clauses(self, literal, args):
+        return []
 
     def match(self, redex, variables):
-        if self.name in variables:
-            if redex != variables[self.name]:
-                return False
-            else:
-                return True
-        else:
+        if self.name not in variables:
             variables[self.name] = redex
             return True
+        return variables[self.name] is redex
 
     def substitute(self, variables):
         return variables[self.name]
 
 
 class Not(Term):
+    __slots__ = ()
+
     def __init__(self, child):
         super().__init__([child])
 
-    def __hash__(self):
-        return hash(self.children[0])
-
     def __str__(self):
+        if self._depth > RECURSION_DEPTH:
+            return super().__str__()
         return f"!{self.children[0]}"
 
-    def eval(self, variables):
-        return not self.children[0].eval(variables)
+    def pieces(self):
+        return ["!", self.children[0]]
+
+    def token(self):
+        return "!"
+
+    def evaluate(self, variables):
+        return not self.children[0].evaluate(variables)
+
+    def bitwise(self, args, values, full):
+        return full ^ args[0]
+
+    def clauses(self, literal, args):
+        return [[-literal, -args[0]], [literal, args[0]]]
+
+    def expression(self, args, vectorized):
+        if vectorized:
+            return f"logical_not({args[0]})"
+        return f"not {args[0]}"
 
 
 class Binary(Term):
-    def __init__(self, left, right, symbol):
-        super().__init__([left, right])
-        self.symbol = symbol
+    __slots__ = ()
 
-    def __hash__(self):
-        return hash((self.children[0], self.children[1]))
+    def __init__(self, left, right):
+        super().__init__([left, right])
 
     def __str__(self):
+        if self._depth > RECURSION_DEPTH:
+            return super().__str__()
         return f"({self.children[0]} {self.symbol} {self.children[1]})"
 
+    def pieces(self):
+        return ["(", self.children[0], f" {self.symbol} ", self.children[1], ")"]
+
+    def token(self):
+        return self.symbol
+
+    def operands(self):
+        # Operands of the chain of this operator rooted here, left to right
+        operands = []
+        stack = [self]
+        while stack:
+            term = stack.pop()
+            if type(term) is type(self):
+                stack.extend(reversed(term.children))
+            else:
+                operands.append(term)
+        return operands
+
 
 class Or(Binary):
-    def __init__(self, left, right):
-        super().__init__(left, right, "+")
+    __slots__ = ()
+    symbol = "+"
 
-    def eval(self, variables):
-        return (self.children[0].eval(variables) or
-                self.children[1].eval(variables))
+    def evaluate(self, variables):
+        return (self.children[0].evaluate(variables) or
+                self.children[1].evaluate(variables))
+
+    def bitwise(self, args, values, full):
+        return args[0] | args[1]
+
+    def clauses(self, literal, args):
+        return [[literal, -args[0]], [literal, -args[1]],
+                [-literal, args[0], args[1]]]
+
+    def expression(self, args, vectorized):
+        if vectorized:
+            return f"logical_or({args[0]}, {args[1]})"
+        return f"{args[0]} or {args[1]}"
 
 
 class And(Binary):
-    def __init__(self, left, right):
-        super().__init__(left, right, "*")
+    __slots__ = ()
+    symbol = "*"
 
-    def eval(self, variables):
-        return (self.children[0].eval(variables) and
-                self.children[1].eval(variables))
+    def evaluate(self, variables):
+        return (self.children[0].evaluate(variables) and
+                self.children[1].evaluate(variables))
+
+    def bitwise(self, args, values, full):
+        return args[0] & args[1]
+
+    def clauses(self, literal, args):
+        return [[-literal, args[0]], [-literal, args[1]],
+                [literal, -args[0], -args[1]]]
+
+    def expression(self, args, vectorized):
+        if vectorized:
+            return f"logical_and({args[0]}, {args[1]})"
+        return f"{args[0]} and {args[1]}"
+
+
+def symbol(term):
+    # Operators are told apart by class alone, leaves also by their value
+    if term.children:
+        return type(term)
+    return (type(term), term.args())
+
+
+class RuleIndex:
+    # Discrimination tree over the left-hand sides of a rule set. Each path
+    # spells a pattern in preorder with None standing for a pattern variable,
+    # so a term only reaches the rules whose shape it can match.
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.tree = ({}, [])
+        for rule in self.rules:
+            edges, matches = self.tree
+            stack = [rule[0]]
+            while stack:
+                pattern = stack.pop()
+                if isinstance(pattern, Variable):
+                    key = None
+                else:
+                    key = symbol(pattern)
+                    stack.extend(reversed(pattern.children))
+                if key not in edges:
+                    edges[key] = ({}, [])
+                edges, matches = edges[key]
+            matches.append(rule)
+
+        # Identifies the rule set in persistent caches
+        digest = blake2b(digest_size=16)
+        for encoding in sorted(f"{rule[0].encode()} = {rule[1].encode()}"
+                               for rule in self.rules):
+            digest.update(encoding.encode() + b"\n")
+        self.version = digest.hexdigest()
+
+        self.compiled = {rule: compile_rule(rule) for rule in self.rules}
+
+        # Rules by head symbol for rewriting modulo AC, leaving out the ones
+        # that only reorder or regroup operands
+        self.ac_heads = {}
+        for rule in self.rules:
+            if rule[0].canonical() is not rule[1].canonical():
+                key = None if isinstance(rule[0], Variable) else symbol(rule[0])
+                self.ac_heads.setdefault(key, []).append(rule)
+
+    def candidates(self, term):
+        found = []
+        stack = [(self.tree, (term,))]
+        while stack:
+            (edges, matches), pending = stack.pop()
+            if not pending:
+                found.extend(matches)
+                continue
+            first, rest = pending[0], pending[1:]
+            if None in edges:
+                stack.append((edges[None], rest))
+            key = symbol(first)
+            if key in edges:
+                stack.append((edges[key], first.children + rest))
+        return found
+
+
+_INDEXES = {}
+
+
+def rule_index(rules=None):
+    # Rule sets are compiled once and reused for as long as they are unchanged
+    if isinstance(rules, RuleIndex):
+        return rules
+    if rules is None:
+        rules = RULES
+    key = frozenset(rules)
+    index = _INDEXES.get(key)
+    if index is None:
+        index = _INDEXES[key] = RuleIndex(key)
+    return index
+
+
+@lru_cache(maxsize=None)
+def compile_rule(rule):
+    # Generates a function that returns what a term rewrites to under rule,
+    # or None when the pattern does not match. The pattern's tests are
+    # unrolled into straight-line code, binding variables to locals, and the
+    # replacement is built by calling constructors directly. Compiled
+    # functions are shared by every rule set containing the rule.
+    pattern, replacement = rule
+    lines = ["def apply(t):"]
+    namespace = {}
+    bound = {}
+    stack = [(pattern, "t")]
+    while stack:
+        term, local = stack.pop()
+        if isinstance(term, Variable):
+            if term.name not in bound:
+                bound[term.name] = local
+                continue
+            test = f"{local} is not {bound[term.name]}"
+        elif term.children:
+            cls = namespace.setdefault(type(term).__name__, type(term))
+            lines.append(f"    if {local}.__class__ is not {cls.__name__}:")
+            lines.append("        return None")
+            children = [f"{local}{i}" for i in range(len(term.children))]
+            lines.append(f"    {', '.join(children)}, = {local}.children")
+            stack.extend(reversed(list(zip(term.children, children))))
+            continue
+        else:
+            test = f"{local} is not k{len(namespace)}"
+            namespace[f"k{len(namespace)}"] = term
+        lines.append(f"    if {test}:")
+        lines.append("        return None")
+
+    results = {}
+    for term in replacement.postorder():
+        if isinstance(term, Variable):
+            results[term] = bound[term.name]
+        elif term.children:
+            cls = namespace.setdefault(type(term).__name__, type(term))
+            args = ", ".join(results[child] for child in term.children)
+            results[term] = f"r{len(results)}"
+            lines.append(f"    {results[term]} = {cls.__name__}({args})")
+        else:
+            results[term] = f"k{len(namespace)}"
+            namespace[results[term]] = term
+    lines.append(f"    return {results[replacement]}")
+
+    exec(compile("\n".join(lines), "<rule>", "exec"), namespace)
+    return namespace["apply"]
+
+
+def decode(text):
+    # Inverse of Term.encode()
+    stack = []
+    for token in reversed(text.split(" ")):
+        if token.startswith("$"):
+            stack.append(Variable(token[1:]))
+        elif token in ("0", "1"):
+            stack.append(Constant(token == "1"))
+        elif token == "!":
+            stack.append(Not(stack.pop()))
+        elif token == "+":
+            stack.append(Or(stack.pop(), stack.pop()))
+        elif token == "*":
+            stack.append(And(stack.pop(), stack.pop()))
+        else:
+            raise ValueError(f"unknown token {token!r}")
+    if len(stack) != 1:
+        raise ValueError(f"malformed encoding {text!r}")
+    return stack[0]
+
+
+TOKEN = re.compile(r"\s*(?:([A-Za-z_][A-Za-z0-9_]*)|([01])|([!*+()]))")
+
+# Binding strength of the operators in the text syntax
+PRECEDENCE = {"+": 1, "*": 2, "!": 3}
+
+
+def parse(text):
+    # Reads the syntax __str__ writes, with ! binding tighter than * and *
+    # tighter than +, and chains grouping to the left, e.g. "!a + b * c".
+    # Uses explicit stacks, so nesting depth is not limited by recursion.
+    operands = []
+    operators = []
+
+    def reduce():
+        operator = operators.pop()
+        if operator == "!":
+            operands.append(Not(operands.pop()))
+        else:
+            right = operands.pop()
+            left = operands.pop()
+            operands.append((Or if operator == "+" else And)(left, right))
+
+    position = 0
+    expect_operand = True
+    text = text.rstrip()
+    while position < len(text):
+        token = TOKEN.match(text, position)
+        if token is None:
+            raise ValueError(f"unexpected character at {position} in {text!r}")
+        name, constant, symbol = token.groups()
+        position = token.end()
+        if expect_operand:
+            if name is not None:
+                operands.append(Variable(name))
+                expect_operand = False
+            elif constant is not None:
+                operands.append(Constant(constant == "1"))
+                expect_operand = False
+            elif symbol in ("!", "("):
+                operators.append(symbol)
+            else:
+                raise ValueError(f"expected an operand at {token.start(3)} "
+                                 f"in {text!r}")
+        elif symbol in ("+", "*"):
+            while (operators and operators[-1] != "(" and
+                   PRECEDENCE[operators[-1]] >= PRECEDENCE[symbol]):
+                reduce()
+            operators.append(symbol)
+            expect_operand = True
+        elif symbol == ")":
+            while operators and operators[-1] != "(":
+                reduce()
+            if not operators:
+                raise ValueError(f"unbalanced ')' in {text!r}")
+            operators.pop()
+        else:
+            raise ValueError(f"expected an operator at {token.start()} "
+                             f"in {text!r}")
+    if expect_operand:
+        raise ValueError(f"incomplete expression {text!r}")
+    while operators:
+        if operators[-1] == "(":
+            raise ValueError(f"unbalanced '(' in {text!r}")
+        reduce()
+    return operands[0]
+
+
+def read_terms(file):
+    # Parses one expression per line, lazily; blank lines and lines
+    # starting with # are skipped
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield parse(line)
+
+
+def write_terms(terms, file):
+    for term in terms:
+        file.write(f"{term}\n")
+
+
+# Binary format: MAGIC, then one record per term holding its distinct
+# subterms children first, each an opcode followed by its operands, with
+# children referred to by how many nodes back they are. Records are
+# independent so files can be read and written one term at a time.
+MAGIC = b"GATES\x01"
+OPCODES = {Not: 3, And: 4, Or: 5}
+CLASSES = {opcode: cls for cls, opcode in OPCODES.items()}
+
+
+def write_varint(file, number):
+    while number > 0x7F:
+        file.write(bytes([number & 0x7F | 0x80]))
+        number >>= 7
+    file.write(bytes([number]))
+
+
+def read_varint(file, byte=None):
+    number = shift = 0
+    while True:
+        if byte is None:
+            byte = file.read(1)
+        if not byte:
+            raise EOFError("truncated term record")
+        number |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return number
+        shift += 7
+        byte = None
+
+
+def dump(terms, file):
+    file.write(MAGIC)
+    for term in terms:
+        nodes = term.postorder()
+        indices = {}
+        write_varint(file, len(nodes))
+        for index, node in enumerate(nodes):
+            indices[node] = index
+            if isinstance(node, Constant):
+                file.write(bytes([int(node.value)]))
+            elif isinstance(node, Variable):
+                name = node.name.encode()
+                file.write(b"\x02")
+                write_varint(file, len(name))
+                file.write(name)
+            else:
+                file.write(bytes([OPCODES[type(node)]]))
+                for child in node.children:
+                    write_varint(file, index - indices[child])
+
+
+def load(file):
+    # Generator over the terms written by dump()
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a term file")
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return
+        nodes = []
+        for index in range(read_varint(file, byte)):
+            opcode = read_varint(file)
+            if opcode < 2:
+                nodes.append(Constant(opcode == 1))
+            elif opcode == 2:
+                nodes.append(Variable(file.read(read_varint(file)).decode()))
+            else:
+                cls = CLASSES[opcode]
+                arity = 1 if cls is Not else 2
+                nodes.append(cls(*[nodes[index - read_varint(file)]
+                                   for _ in range(arity)]))
+        yield nodes[-1]
+
+
+def undump(data):
+    # The single term dump() wrote as data
+    return next(load(BytesIO(data)))
+
+
+class NodeTable:
+    # Compact store for very large circuits, as parallel arrays: node i has
+    # opcode ops[i], numbered as in dump(), and operands first[i] and
+    # second[i], the indices of its children for gates and the index of its
+    # name in names for variables. Children always come before their
+    # parents. Nodes are hash-consed through an open-addressing table of
+    # node indices, so each costs about 17 bytes against a few hundred as a
+    # Term. The arrays support the buffer protocol, so numpy.frombuffer can
+    # wrap them without copying.
+    def __init__(self):
+        self.ops = array("B")
+        self.first = array("i")
+        self.second = array("i")
+        self.names = []
+        self.variables = {}
+        self.slots = array("i", [-1]) * 8
+
+    def __len__(self):
+        return len(self.ops)
+
+    def nbytes(self):
+        return sum(len(column) * column.itemsize
+                   for column in (self.ops, self.first, self.second,
+                                  self.slots))
+
+    def add(self, opcode, first=0, second=0):
+        # Index of the node, which is added unless it exists already
+        if 2 * len(self.ops) >= len(self.slots):
+            self.grow()
+        mask = len(self.slots) - 1
+        slot = hash((opcode, first, second)) & mask
+        while True:
+            index = self.slots[slot]
+            if index < 0:
+                break
+            if (self.ops[index] == opcode and self.first[index] == first and
+                    self.second[index] == second):
+                return index
+            slot = (slot + 1) & mask
+        index = len(self.ops)
+        self.ops.append(opcode)
+        self.first.append(first)
+        self.second.append(second)
+        self.slots[slot] = index
+        return index
+
+    def grow(self):
+        self.slots = array("i", [-1]) * (2 * len(self.slots))
+        mask = len(self.slots) - 1
+        for index in range(len(self.ops)):
+            slot = hash((self.ops[index], self.first[index],
+                         self.second[index])) & mask
+            while self.slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            self.slots[slot] = index
+
+    def variable(self, name):
+        if name not in self.variables:
+            self.variables[name] = len(self.names)
+            self.names.append(name)
+        return self.add(2, self.variables[name])
+
+    def add_term(self, term):
+        # Index of the root of term, adding whichever of its subterms are
+        # missing
+        indices = {}
+        for node in term.postorder():
+            if isinstance(node, Constant):
+                indices[node] = self.add(int(node.value))
+            elif isinstance(node, Variable):
+                indices[node] = self.variable(node.name)
+            else:
+                children = [indices[child] for child in node.children]
+                indices[node] = self.add(OPCODES[type(node)], *children)
+        return indices[term]
+
+    def reachable(self, roots):
+        # Flags of the nodes below any of roots, found in one sweep from the
+        # highest index down
+        marked = bytearray(len(self.ops))
+        for root in roots:
+            marked[root] = 1
+        for index in range(max(roots, default=-1), -1, -1):
+            if marked[index]:
+                opcode = self.ops[index]
+                if opcode > 2:
+                    marked[self.first[index]] = 1
+                if opcode > 3:
+                    marked[self.second[index]] = 1
+        return marked
+
+    def term(self, root):
+        # The Term of the node root
+        marked = self.reachable([root])
+        terms = {}
+        for index in range(root + 1):
+            if not marked[index]:
+                continue
+            opcode = self.ops[index]
+            if opcode < 2:
+                terms[index] = Constant(opcode == 1)
+            elif opcode == 2:
+                terms[index] = Variable(self.names[self.first[index]])
+            elif opcode == 3:
+                terms[index] = Not(terms[self.first[index]])
+            else:
+                terms[index] = CLASSES[opcode](terms[self.first[index]],
+                                               terms[self.second[index]])
+        return terms[root]
+
+    def depths(self):
+        depths = array("i", bytes(4 * len(self.ops)))
+        for index in range(len(self.ops)):
+            opcode = self.ops[index]
+            depth = 0
+            if opcode > 2:
+                depth = depths[self.first[index]]
+            if opcode > 3:
+                depth = max(depth, depths[self.second[index]])
+            depths[index] = depth + 1
+        return depths
+
+    def costs(self):
+        # Tree costs, as for Term.cost(); a list, as they can exceed any
+        # fixed width when subterms are shared
+        costs = []
+        for index in range(len(self.ops)):
+            opcode = self.ops[index]
+            cost = 1
+            if opcode > 2:
+                cost += costs[self.first[index]]
+            if opcode > 3:
+                cost += costs[self.second[index]]
+            costs.append(cost)
+        return costs
+
+    def dag_cost(self, roots):
+        return sum(self.reachable(roots))
+
+    def hashes(self):
+        # Structural hashes that agree between tables for equal subterms
+        hashes = array("q")
+        for index in range(len(self.ops)):
+            opcode = self.ops[index]
+            if opcode < 2:
+                hashes.append(hash((opcode,)))
+            elif opcode == 2:
+                hashes.append(hash((opcode, self.names[self.first[index]])))
+            elif opcode == 3:
+                hashes.append(hash((opcode, hashes[self.first[index]])))
+            else:
+                hashes.append(hash((opcode, hashes[self.first[index]],
+                                    hashes[self.second[index]])))
+        return hashes
+
+    def simulate(self, roots, values, full):
+        # Values of roots on bit vectors, as for Term.simulate(). Each
+        # node's vector is dropped after its last parent has used it.
+        marked = self.reachable(roots)
+        uses = array("i", bytes(4 * len(self.ops)))
+        for index in range(len(self.ops)):
+            if marked[index] and self.ops[index] > 2:
+                uses[self.first[index]] += 1
+                if self.ops[index] > 3:
+                    uses[self.second[index]] += 1
+        for root in roots:
+            uses[root] += 1
+        vectors = {}
+        for index in range(max(roots, default=-1) + 1):
+            if not marked[index]:
+                continue
+            opcode = self.ops[index]
+            if opcode < 2:
+                vectors[index] = full if opcode else full ^ full
+                continue
+            if opcode == 2:
+                vectors[index] = values[self.names[self.first[index]]]
+                continue
+            children = [self.first[index]]
+            if opcode > 3:
+                children.append(self.second[index])
+            args = [vectors[child] for child in children]
+            for child in children:
+                uses[child] -= 1
+                if uses[child] == 0:
+                    del vectors[child]
+            if opcode == 3:
+                vectors[index] = full ^ args[0]
+            elif opcode == 4:
+                vectors[index] = args[0] & args[1]
+            else:
+                vectors[index] = args[0] | args[1]
+        return [vectors[root] for root in roots]
+
+
+def node_table(terms):
+    # A NodeTable holding terms, and the index of each of their roots
+    table = NodeTable()
+    return table, [table.add_term(term) for term in terms]
+
+
+def load_table(file):
+    # A NodeTable holding every term written by dump(), read without
+    # creating Terms, and the index of each of their roots
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a term file")
+    table = NodeTable()
+    roots = []
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return table, roots
+        nodes = array("i")
+        for index in range(read_varint(file, byte)):
+            opcode = read_varint(file)
+            if opcode < 2:
+                nodes.append(table.add(opcode))
+            elif opcode == 2:
+                nodes.append(table.variable(
+                    file.read(read_varint(file)).decode()))
+            else:
+                arity = 1 if opcode == 3 else 2
+                nodes.append(table.add(opcode, *[
+                    nodes[index - read_varint(file)] for _ in range(arity)]))
+        roots.append(nodes[-1])
+
+
+class SimplifyCache:
+    # Simplified terms stored in SQLite, keyed by the fingerprint of the
+    # canonical input together with the rule set version, engine and options,
+    # so every ordering of an expression shares one entry. An entry is never
+    # costlier than the canonical input, and a hit never costlier than the
+    # term looked up. Holds at most size entries and evicts the least
+    # recently used.
+    FORMAT = "2"
+
+    def __init__(self, path, size=100000):
+        self.size = size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta "
+                                "(key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                "(key TEXT PRIMARY KEY, term TEXT, "
+                                "cost INTEGER, used INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_used "
+                                "ON results (used)")
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'format'").fetchone()
+        if row is None or row[0] != self.FORMAT:
+            self.connection.execute("DELETE FROM results")
+            self.connection.execute("INSERT OR REPLACE INTO meta "
+                                    "VALUES ('format', ?)", (self.FORMAT,))
+        self.count, self.clock = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(MAX(used), 0) FROM results").fetchone()
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def key(self, term, setting):
+        digest = blake2b(setting.encode(), digest_size=16)
+        digest.update(term.canonical().fingerprint())
+        return digest.hexdigest()
+
+    def get(self, term, setting):
+        key = self.key(term, setting)
+        row = self.connection.execute(
+            "SELECT term FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.clock += 1
+        self.connection.execute("UPDATE results SET used = ? WHERE key = ?",
+                                (self.clock, key))
+        result = decode(row[0])
+        return term if term.cost() < result.cost() else result
+
+    def put(self, term, setting, result):
+        # The entry is shared by the whole orbit of term, so it is at most
+        # as costly as its canonical member
+        if term.canonical().cost() < result.cost():
+            result = term.canonical()
+        self.clock += 1
+        values = (result.encode(), result.cost(), self.clock,
+                  self.key(term, setting))
+        cursor = self.connection.execute(
+            "UPDATE results SET term = ?, cost = ?, used = ? WHERE key = ?",
+            values)
+        if cursor.rowcount == 0:
+            self.connection.execute("INSERT INTO results (term, cost, used, "
+                                    "key) VALUES (?, ?, ?, ?)", values)
+            self.count += 1
+        if self.count > self.size:
+            # Evict a little more than needed so eviction stays infrequent
+            excess = self.count - self.size + self.size // 10
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                "ORDER BY used LIMIT ?)", (excess,))
+            self.count -= excess
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class SimplifyMemo:
+    # In-memory results for one session, with the get/put interface of
+    # SimplifyCache, keyed by the term itself rather than its canonical form.
+    # Holds at most size entries and evicts the least recently used.
+    def __init__(self, size=100000):
+        self.size = size
+        self.results = OrderedDict()
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, term, setting):
+        result = self.results.get((setting, term))
+        if result is not None:
+            self.results.move_to_end((setting, term))
+        return result
+
+    def put(self, term, setting, result):
+        self.results[(setting, term)] = result
+        self.results.move_to_end((setting, term))
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+
+
+def cacheable(engine, options):
+    # Whether simplify results can be cached: timeouts, which portfolios
+    # always have, depend on the machine's speed, and callables such as
+    # heuristics have no repr that identifies them across runs
+    return (engine != "portfolio" and options.get("timeout") is None and
+            not any(callable(value) for value in options.values()))
+
+
+def simplify_encoded(encodings, options):
+    # Worker side of simplify_many(); terms travel in their encoded form,
+    # which is far smaller and faster to send than pickled objects
+    return [decode(encoding).simplify(**options).encode()
+            for encoding in encodings]
+
+
+def simplify_many(terms, workers=None, ordered=True, chunksize=64,
+                  **options):
+    # Simplifies terms across a pool of worker processes, each identical term
+    # only once. Returns the results in input order, or with ordered=False a
+    # generator of (position, result) pairs as they complete. options are
+    # passed on to simplify() and must be picklable.
+    terms = list(terms)
+    positions = {}
+    for position, term in enumerate(terms):
+        positions.setdefault(term, []).append(position)
+    unique = list(positions)
+    chunks = [unique[i:i + chunksize] for i in range(0, len(unique), chunksize)]
+    stream = simplify_chunks(chunks, positions, workers, options)
+    if not ordered:
+        return stream
+    results = [None] * len(terms)
+    for position, result in stream:
+        results[position] = result
+    return results
+
+
+def simplify_chunks(chunks, positions, workers, options):
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for chunk in chunks:
+            encodings = [term.encode() for term in chunk]
+            futures[pool.submit(simplify_encoded, encodings, options)] = chunk
+        for future in as_completed(futures):
+            for term, encoding in zip(futures[future], future.result()):
+                result = decode(encoding)
+                for position in positions[term]:
+                    yield position, result
+
+
+def shared_cost(terms):
+    # Cost of a circuit computing every one of terms, each distinct subterm
+    # built once and shared between them
+    seen = set()
+    for term in terms:
+        term.postorder(seen=seen)
+    return len(seen)
+
+
+def netlist(terms, prefix="n"):
+    # Factors out the subterms used more than once, within one term or
+    # across several, as named signals. Returns the assignments, (name,
+    # term) pairs in which earlier signals appear as Variables, and terms
+    # rewritten over them. Names are prefix and a number, skipping input
+    # names.
+    terms = list(terms)
+    seen = set()
+    order = []
+    for term in terms:
+        order.extend(term.postorder(seen=seen))
+    uses = dict.fromkeys(order, 0)
+    for term in order:
+        for child in term.children:
+            uses[child] += 1
+    for term in terms:
+        uses[term] += 1
+
+    taken = {variable.name for term in terms for variable in term.inputs()}
+    names = (f"{prefix}{i}" for i in count())
+    assignments = []
+    signals = {}
+    for term in order:
+        signals[term] = term.rebuild([signals[child]
+                                      for child in term.children])
+        if term.children and uses[term] > 1:
+            name = next(names)
+            while name in taken:
+                name = next(names)
+            assignments.append((name, signals[term]))
+            signals[term] = Variable(name)
+    return assignments, [signals[term] for term in terms]
+
+
+def merge_equivalent(terms, vectors=SIMULATION_VECTORS, seed=0):
+    # Replaces every subterm of terms with the first one, children first,
+    # that computes the same function, so that logic written differently in
+    # different places is built once. Subterms are grouped by their values
+    # on random input vectors and only proved equivalent within a group.
+    terms = list(terms)
+    names = sorted({variable.name for term in terms
+                    for variable in term.inputs()})
+    generator = Random(seed)
+    values = {name: generator.getrandbits(vectors) for name in names}
+    full = (1 << vectors) - 1
+    merged = {}
+    signatures = {}
+    groups = {}
+    seen = set()
+    for root in terms:
+        for term in root.postorder(seen=seen):
+            rebuilt = term.rebuild([merged[child] for child in term.children])
+            if rebuilt not in signatures:
+                signatures[rebuilt] = rebuilt.bitwise(
+                    [signatures[child] for child in rebuilt.children],
+                    values, full)
+                group = groups.setdefault(signatures[rebuilt], [])
+                for candidate in group:
+                    if candidate.equivalent(rebuilt, vectors=0):
+                        rebuilt = candidate
+                        break
+                else:
+                    group.append(rebuilt)
+            merged[term] = rebuilt
+    return [merged[term] for term in terms]
+
+
+def simplify_outputs(terms, rules=None, **options):
+    # Simplifies the outputs of a multi-output circuit for their shared
+    # cost. Each is simplified on its own and keeps whichever of its
+    # original and simplified forms adds fewer new subterms to the outputs
+    # before it; equivalent logic across all of them is then merged. options
+    # are passed on to simplify().
+    chosen = []
+    seen = set()
+    for term in terms:
+        result = term.simplify(rules, **options)
+        added = []
+        for candidate in (term, result):
+            new = candidate.postorder(seen=seen)
+            seen.difference_update(new)
+            added.append(len(new))
+        chosen.append(term if added[0] < added[1] else result)
+        chosen[-1].postorder(seen=seen)
+    merged = merge_equivalent(chosen)
+    return merged if shared_cost(merged) < shared_cost(chosen) else chosen
+
+
+def chain(cls, operands):
+    # Canonical And/Or (cls) of canonical operands
+    unique = set()
+    for operand in operands:
+        if type(operand) is cls:
+            unique.update(operand.operands())
+        else:
+            unique.add(operand)
+    ordered = sorted(unique, key=Term.fingerprint)
+    result = ordered[0]
+    for operand in ordered[1:]:
+        result = cls(result, operand)
+        result._canonical = result
+    return result
+
+
+def ac_match(pattern, term, variables):
+    # Yields every extension of variables under which the canonical term
+    # matches pattern modulo AC. An And/Or pattern splits a chain between
+    # its two sides as one operand against the rest.
+    if isinstance(pattern, Variable):
+        bound = variables.get(pattern.name)
+        if bound is None:
+            yield {**variables, pattern.name: term}
+        elif bound is term:
+            yield variables
+        return
+    if isinstance(pattern, Binary):
+        if type(term) is type(pattern):
+            yield from ac_match_operands(pattern, term.operands(), variables)
+        return
+    if symbol(pattern) != symbol(term):
+        return
+    if not pattern.children:
+        yield variables
+        return
+    yield from ac_match(pattern.children[0], term.children[0], variables)
+
+
+def ac_match_operands(pattern, operands, variables):
+    cls = type(pattern)
+    if len(operands) == 2:
+        splits = [(operands[0], operands[1]), (operands[1], operands[0])]
+    else:
+        splits = []
+        for i in range(len(operands)):
+            rest = chain(cls, operands[:i] + operands[i + 1:])
+            splits += [(operands[i], rest), (rest, operands[i])]
+    left, right = pattern.children
+    for first, second in splits:
+        for extended in ac_match(left, first, variables):
+            yield from ac_match(right, second, extended)
+
+
+def ac_positions(term):
+    # The canonical term, the operands of its chains and the children of its
+    # other operators, each once and inner ones first
+    order = []
+    seen = set()
+    stack = [(term, False)]
+    while stack:
+        position, expanded = stack.pop()
+        if expanded:
+            order.append(position)
+        elif position not in seen:
+            seen.add(position)
+            stack.append((position, True))
+            if isinstance(position, Binary):
+                inner = position.operands()
+            else:
+                inner = position.children
+            stack.extend((child, False) for child in reversed(inner))
+    return order
+
+
+def ac_neighbors(term, index, stats=None):
+    # Canonical terms one rewrite away from the canonical term. Chains are
+    # rewritten one pair of operands at a time, in any order.
+    neighbors = {}
+    for position in ac_positions(term):
+        neighbors[position] = ac_rewrites(position, index, neighbors, stats)
+    return neighbors[term]
+
+
+def ac_rewrites(term, index, inner, stats=None):
+    # Neighbors of term given those of its operands or children in inner
+    neighbors = set()
+
+    for rule in index.ac_heads.get(None, ()):
+        pattern, replacement = rule
+        for variables in timed(stats, rule, ac_match(pattern, term, {})):
+            neighbors.add(replacement.substitute(variables).canonical())
+
+    rules = index.ac_heads.get(symbol(term), ())
+    if isinstance(term, Binary):
+        cls = type(term)
+        operands = term.operands()
+        for i in range(len(operands)):
+            for j in range(i + 1, len(operands)):
+                pair = [operands[i], operands[j]]
+                rest = operands[:i] + operands[i + 1:j] + operands[j + 1:]
+                for rule in rules:
+                    pattern, replacement = rule
+                    for variables in timed(stats, rule, ac_match_operands(
+                            pattern, pair, {})):
+                        rewritten = replacement.substitute(variables)
+                        neighbors.add(chain(cls, rest + [rewritten.canonical()]))
+        for i in range(len(operands)):
+            rest = operands[:i] + operands[i + 1:]
+            for neighbor in inner[operands[i]]:
+                neighbors.add(chain(cls, rest + [neighbor]))
+    else:
+        for rule in rules:
+            pattern, replacement = rule
+            for variables in timed(stats, rule, ac_match(pattern, term, {})):
+                neighbors.add(replacement.substitute(variables).canonical())
+        for i in range(len(term.children)):
+            for child_neighbor in inner[term.children[i]]:
+                children = list(term.children)
+                children[i] = child_neighbor
+                neighbors.add(term.rebuild(children).canonical())
+
+    return neighbors
+
+
+class Stats:
+    # Filled in by a simplify run when passed as stats=. Per rule, keyed by
+    # the rule itself: match attempts, hits (matches found) and seconds spent
+    # matching and rewriting. trajectory lists (seconds since the Stats was
+    # made, cost) after each improvement, and on_improve, when given, is
+    # called with the improved term and that cost. The greedy engine improves
+    # one subterm at a time, so it passes the subterm and the cost the whole
+    # result has reached, or with whole set the whole result so far.
+    whole = False
+
+    def __init__(self, on_improve=None):
+        self.on_improve = on_improve
+        self.start = perf_counter()
+        self.attempts = {}
+        self.hits = {}
+        self.time = {}
+        self.expansions = 0
+        self.frontier = 0
+        self.explored = 0
+        self.trajectory = []
+
+    def attempt(self, rule, hits, seconds):
+        self.attempts[rule] = self.attempts.get(rule, 0) + 1
+        self.hits[rule] = self.hits.get(rule, 0) + hits
+        self.time[rule] = self.time.get(rule, 0) + seconds
+
+    def expand(self, frontier, explored):
+        self.expansions += 1
+        self.frontier = max(self.frontier, frontier)
+        self.explored = max(self.explored, explored)
+
+    def improve(self, term, cost):
+        self.trajectory.append((perf_counter() - self.start, cost))
+        if self.on_improve is not None:
+            self.on_improve(term, cost)
+
+    def report(self, file=None):
+        # Rules slowest first, then the search counters
+        print(f"{'seconds':>11} {'attempts':>9} {'hits':>9}  rule", file=file)
+        for rule in sorted(self.time, key=self.time.get, reverse=True):
+            print(f"{self.time[rule]:10.6f}s {self.attempts[rule]:9} "
+                  f"{self.hits[rule]:9}  {rule[0]} = {rule[1]}", file=file)
+        print(f"expansions {self.expansions}, peak frontier {self.frontier}, "
+              f"peak explored {self.explored}", file=file)
+        if self.trajectory:
+            print("cost " + " ".join(f"{cost}@{seconds:.3f}s" for seconds, cost
+                                     in self.trajectory), file=file)
+
+
+def timed(stats, rule, matches):
+    # Matches of rule, recorded in stats when given
+    if stats is None:
+        return matches
+    start = perf_counter()
+    matches = list(matches)
+    stats.attempt(rule, len(matches), perf_counter() - start)
+    return matches
+
+
+def greedy(term, index, ac=False, stats=None, memo=None, library=False):
+    # Simplifies every subterm bottom-up, then climbs from the result. With
+    # ac, the search moves between canonical representatives of whole AC
+    # orbits instead of individual orderings and groupings. memo, a
+    # SimplifyMemo or SimplifyCache, keeps the result for every subterm, so
+    # subterms seen before, in this call or an earlier one, are looked up
+    # and everything below them is skipped. With library, subterms with at
+    # most LIBRARY_INPUTS inputs are replaced by an optimal circuit instead
+    # of climbing.
+    options = [("ac", ac), ("library", library)]
+    setting = repr((index.version, "greedy",
+                    [(key, value) for key, value in options if value]))
+    remembered = {}
+    if memo is None:
+        order = term.postorder()
+    else:
+        order = []
+        stack = [(term, False)]
+        while stack:
+            subterm, expanded = stack.pop()
+            if expanded:
+                order.append(subterm)
+            elif subterm not in remembered:
+                result = memo.get(subterm, setting)
+                if result is not None:
+                    remembered[subterm] = result
+                    order.append(subterm)
+                else:
+                    remembered[subterm] = None
+                    stack.append((subterm, True))
+                    for child in reversed(subterm.children):
+                        stack.append((child, False))
+    if stats is not None:
+        # How often each subterm appears in the tree, to follow the cost of
+        # the whole result as its subterms improve
+        everything = term.postorder() if stats.whole else None
+        occurrences = dict.fromkeys(order, 0)
+        occurrences[term] = 1
+        for subterm in reversed(order):
+            if remembered.get(subterm) is None:
+                for child in subterm.children:
+                    occurrences[child] += occurrences[subterm]
+        total = term.cost()
+    simplified = {}
+    for subterm in order:
+        result = remembered.get(subterm)
+        if result is not None:
+            simplified[subterm] = result
+            if stats is not None and result.cost() < subterm.cost():
+                total -= occurrences[subterm] * (subterm.cost() - result.cost())
+                improved(stats, everything, simplified, subterm, result,
+                         total)
+            continue
+        rebuilt = subterm.rebuild([simplified[child]
+                                   for child in subterm.children])
+        state = rebuilt.canonical() if ac else rebuilt
+        if library and len(state.inputs()) <= LIBRARY_INPUTS:
+            result = optimal(state)
+            if ac:
+                result = result.canonical()
+            if result.cost() >= state.cost():
+                result = state
+            if stats is not None and result.cost() < rebuilt.cost():
+                total -= occurrences[subterm] * (rebuilt.cost() -
+                                                 result.cost())
+                improved(stats, everything, simplified, subterm, result,
+                         total)
+        elif stats is None:
+            result = climb(state, index, ac)
+        else:
+            if state.cost() < rebuilt.cost():
+                total -= occurrences[subterm] * (rebuilt.cost() - state.cost())
+                improved(stats, everything, simplified, subterm, state, total)
+            result = climb(state, index, ac, stats, total,
+                           occurrences[subterm],
+                           lambda neighbor, total: improved(
+                               stats, everything, simplified, subterm,
+                               neighbor, total))
+            total -= occurrences[subterm] * (state.cost() - result.cost())
+        simplified[subterm] = result
+        if memo is not None:
+            memo.put(subterm, setting, result)
+    return simplified[term]
+
+
+def improved(stats, everything, simplified, subterm, result, total):
+    # Reports that greedy simplified subterm to result, reaching total for
+    # the whole term. With stats.whole the whole term is reported, rebuilt
+    # from everything, its postorder, with the subterms simplified so far.
+    if stats.whole:
+        rebuilt = {}
+        for node in everything:
+            if node == subterm:
+                rebuilt[node] = result
+            elif node in simplified:
+                rebuilt[node] = simplified[node]
+            else:
+                rebuilt[node] = node.rebuild([rebuilt[child]
+                                              for child in node.children])
+        result = rebuilt[everything[-1]]
+    stats.improve(result, total)
+
+
+def climb(state, index, ac, stats=None, total=0, occurrences=1,
+          improve=None):
+    # With stats, total is the cost of the whole result before this climb and
+    # the climbed term appears in it occurrences times. Improvements go to
+    # improve, stats.improve unless given.
+    frontier = {state}
+    best = state
+    explored = set()
+    while len(frontier) > 0:
+        state = frontier.pop()
+        explored.add(state)
+        if stats is not None:
+            stats.expand(len(frontier) + 1, len(explored))
+
+        for _, neighbor in state.iter_neighbors(index, ac, stats=stats):
+            if neighbor not in explored:
+                if neighbor.cost() < best.cost():
+                    if stats is not None:
+                        total -= occurrences * (best.cost() - neighbor.cost())
+                        (improve or stats.improve)(neighbor, total)
+                    frontier = {neighbor}
+                    best = neighbor
+                    break
+                else:
+                    frontier.add(neighbor)
+
+    return best
+
+
+OBJECTIVES = {"tree": Term.cost, "dag": Term.dag_cost}
+
+SearchResult = namedtuple("SearchResult", ["term", "reason"])
+
+
+def search(term, index, heuristic=None, expansions=10000, memory=None,
+           timeout=None, ac=False, stats=None, objective="tree", seed=None):
+    # Best-first search that always expands the cheapest term seen so far.
+    # heuristic, when given, must never exceed the cost of the cheapest term
+    # reachable from its argument; terms that cannot beat the best are then
+    # pruned and the search stops as soon as nothing left can. expansions,
+    # memory (size of the explored set) and timeout (seconds) bound the work;
+    # None lifts a bound, and the rewrite space is infinite, so lifting all
+    # of them only terminates with a heuristic. Returns the best term found
+    # and why the search stopped. With ac it works on canonical terms. The
+    # objective is "tree" for cost() or "dag" for dag_cost(). Terms of equal
+    # priority are expanded oldest first, or in a random order drawn from
+    # seed when it is given.
+    if objective not in OBJECTIVES:
+        raise ValueError(f"unknown objective {objective!r}")
+    measure = OBJECTIVES[objective]
+    if ac:
+        term = term.canonical()
+    priority = heuristic if heuristic is not None else measure
+    deadline = None if timeout is None else monotonic() + timeout
+    tie = count() if seed is None else iter(Random(seed).random, None)
+    best = term
+    frontier = [(priority(term), next(tie), term)]
+    explored = {term}
+    expanded = 0
+    while frontier:
+        bound, _, state = heappop(frontier)
+        if heuristic is not None and bound >= measure(best):
+            return SearchResult(best, "bound")
+        if expansions is not None and expanded >= expansions:
+            return SearchResult(best, "expansions")
+        if deadline is not None and monotonic() >= deadline:
+            return SearchResult(best, "timeout")
+        expanded += 1
+        if stats is not None:
+            stats.expand(len(frontier) + 1, len(explored))
+
+        for neighbor in state.neighbors(index, ac, stats):
+            if neighbor in explored:
+                continue
+            if memory is not None and len(explored) >= memory:
+                return SearchResult(best, "memory")
+            explored.add(neighbor)
+            if measure(neighbor) < measure(best):
+                best = neighbor
+                if stats is not None:
+                    stats.improve(best, measure(best))
+            estimate = priority(neighbor)
+            if heuristic is None or estimate < measure(best):
+                heappush(frontier, (estimate, next(tie), neighbor))
+
+    return SearchResult(best, "exhausted")
+
+
+def best_first(term, index, **budgets):
+    return search(term, index, **budgets).term
+
+
+class EGraph:
+    # Equivalence classes of terms. An e-node is a tuple of an operator
+    # symbol followed by the ids of its children's classes; classes are
+    # merged with a union-find and kept congruent by rebuild().
+    def __init__(self):
+        self.parents = []
+        self.hashcons = {}
+        self.nodes = {}
+        self.uses = {}
+        self.pending = []
+
+    def find(self, id):
+        root = id
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[id] != root:
+            self.parents[id], id = root, self.parents[id]
+        return root
+
+    def canonicalize(self, node):
+        return node[:1] + tuple(self.find(child) for child in node[1:])
+
+    def add_node(self, node):
+        node = self.canonicalize(node)
+        if node in self.hashcons:
+            return self.find(self.hashcons[node])
+        id = len(self.parents)
+        self.parents.append(id)
+        self.hashcons[node] = id
+        self.nodes[id] = {node}
+        self.uses[id] = []
+        for child in node[1:]:
+            self.uses[child].append((node, id))
+        return id
+
+    def add(self, term):
+        ids = {}
+        for subterm in term.postorder():
+            node = (symbol(subterm),) + tuple(ids[child]
+                                              for child in subterm.children)
+            ids[subterm] = self.add_node(node)
+        return ids[term]
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        if len(self.nodes[a]) < len(self.nodes[b]):
+            a, b = b, a
+        self.parents[b] = a
+        self.nodes[a] |= self.nodes.pop(b)
+        self.uses[a] += self.uses.pop(b)
+        self.pending.append(a)
+        return True
+
+    def rebuild(self):
+        while self.pending:
+            todo = {self.find(id) for id in self.pending}
+            self.pending = []
+            for id in todo:
+                self.repair(self.find(id))
+        for id in self.nodes:
+            self.nodes[id] = {self.canonicalize(node)
+                              for node in self.nodes[id]}
+
+    def repair(self, id):
+        # Parents of a merged class may have become congruent to each other
+        for node, parent in self.uses[id]:
+            self.hashcons.pop(node, None)
+            self.hashcons[self.canonicalize(node)] = self.find(parent)
+        uses = {}
+        for node, parent in self.uses[id]:
+            node = self.canonicalize(node)
+            if node in uses:
+                self.union(parent, uses[node])
+            uses[node] = self.find(parent)
+        self.uses[self.find(id)] = list(uses.items())
+
+    def match(self, pattern, id, variables):
+        # Yields every extension of variables under which pattern occurs in
+        # the class id
+        id = self.find(id)
+        if isinstance(pattern, Variable):
+            if pattern.name not in variables:
+                yield {**variables, pattern.name: id}
+            elif self.find(variables[pattern.name]) == id:
+                yield variables
+            return
+        key = symbol(pattern)
+        for node in list(self.nodes[id]):
+            if node[0] == key:
+                yield from self.match_children(pattern.children, node[1:],
+                                               variables)
+
+    def match_children(self, patterns, ids, variables):
+        if not patterns:
+            yield variables
+            return
+        pattern = patterns[0]
+        if isinstance(pattern, Variable):
+            # Inlined from match(), which is the innermost loop of saturation
+            bound = variables.get(pattern.name)
+            if bound is None:
+                variables = {**variables, pattern.name: ids[0]}
+            elif self.find(bound) != self.find(ids[0]):
+                return
+            yield from self.match_children(patterns[1:], ids[1:], variables)
+            return
+        for extended in self.match(pattern, ids[0], variables):
+            yield from self.match_children(patterns[1:], ids[1:], extended)
+
+    def instantiate(self, pattern, variables):
+        if isinstance(pattern, Variable):
+            return variables[pattern.name]
+        node = (symbol(pattern),) + tuple(self.instantiate(child, variables)
+                                          for child in pattern.children)
+        return self.add_node(node)
+
+    def saturate(self, rules, iterations, limit, stats=None):
+        # Applies every rule everywhere until nothing changes or a limit is
+        # reached, and returns the reason for stopping. stats counts each
+        # iteration as an expansion and e-nodes as explored.
+        heads = {}
+        anywhere = []
+        for rule in rules:
+            if isinstance(rule[0], Variable):
+                anywhere.append(rule)
+            else:
+                heads.setdefault(symbol(rule[0]), []).append(rule)
+        for _ in range(iterations):
+            if stats is not None:
+                stats.expand(0, len(self.hashcons))
+            matches = []
+            for id, nodes in self.nodes.items():
+                for node in nodes:
+                    for rule in heads.get(node[0], ()):
+                        pattern, replacement = rule
+                        for variables in timed(stats, rule, self.match_children(
+                                pattern.children, node[1:], {})):
+                            matches.append((replacement, id, variables))
+                for rule in anywhere:
+                    pattern, replacement = rule
+                    for variables in timed(stats, rule,
+                                           self.match(pattern, id, {})):
+                        matches.append((replacement, id, variables))
+            changed = False
+            for replacement, id, variables in matches:
+                if len(self.hashcons) >= limit:
+                    self.rebuild()
+                    return "limit"
+                if self.union(id, self.instantiate(replacement, variables)):
+                    changed = True
+            self.rebuild()
+            if not changed:
+                return "saturated"
+        return "iterations"
+
+    def extract(self, id):
+        # Cheapest term in the class of id, by cost()
+        best = {}
+        changed = True
+        while changed:
+            changed = False
+            for cls, nodes in self.nodes.items():
+                for node in nodes:
+                    children = [self.find(child) for child in node[1:]]
+                    if all(child in best for child in children):
+                        cost = 1 + sum(best[child][0] for child in children)
+                        if cls not in best or cost < best[cls][0]:
+                            best[cls] = (cost, node)
+                            changed = True
+
+        terms = {}
+        stack = [self.find(id)]
+        while stack:
+            cls = stack[-1]
+            node = best[cls][1]
+            children = [self.find(child) for child in node[1:]]
+            missing = [child for child in children if child not in terms]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            if isinstance(node[0], tuple):
+                terms[cls] = node[0][0](*node[0][1])
+            else:
+                terms[cls] = node[0](*[terms[child] for child in children])
+        return terms[self.find(id)]
+
+
+def saturate(term, index, iterations=30, limit=10000, stats=None):
+    # Equality saturation: grows an e-graph of everything the rules can
+    # prove equal to term, up to limit e-nodes, then extracts the cheapest
+    egraph = EGraph()
+    root = egraph.add(term)
+    egraph.saturate(index.rules, iterations, limit, stats)
+    result = egraph.extract(root)
+    if stats is not None:
+        stats.explored = max(stats.explored, len(egraph.hashcons))
+        if result.cost() < term.cost():
+            stats.improve(result, result.cost())
+    return result
+
+
+# Cubes are (value, care) pairs of bit masks over the inputs: input i
+# appears in the product when bit i of care is set, negated when bit i of
+# value is clear.
+
+def cube_rows(cube, vectors, full):
+    value, care = cube
+    rows = full
+    for i, vector in enumerate(vectors):
+        if care >> i & 1:
+            rows &= vector if value >> i & 1 else full ^ vector
+    return rows
+
+
+def prime_implicants(n, on):
+    # Quine-McCluskey: merges cubes differing in one literal until no more
+    # merge, the cubes that never merged are the prime implicants
+    full = (1 << n) - 1
+    current = {(row, full) for row in range(on.bit_length()) if on >> row & 1}
+    primes = set()
+    while current:
+        merged = set()
+        used = set()
+        for value, care in current:
+            for i in range(n):
+                bit = 1 << i
+                if care & bit and (value ^ bit, care) in current:
+                    merged.add((value & ~bit, care & ~bit))
+                    used.add((value, care))
+        primes |= current - used
+        current = merged
+    return primes
+
+
+def cover_exact(n, on):
+    # Essential prime implicants first, then greedily the prime covering
+    # the most remaining rows
+    vectors, full = bit_vectors(n, packed=False)
+    primes = {prime: cube_rows(prime, vectors, full)
+              for prime in prime_implicants(n, on)}
+    cover = []
+    uncovered = on
+    for row in range(on.bit_length()):
+        if on >> row & 1:
+            covering = [prime for prime, rows in primes.items()
+                        if rows >> row & 1]
+            if len(covering) == 1 and uncovered >> row & 1:
+                cover.append(covering[0])
+                uncovered &= ~primes[covering[0]]
+    while uncovered:
+        prime = max(primes, key=lambda prime: (
+            (primes[prime] & uncovered).bit_count(), -prime[1].bit_count()))
+        cover.append(prime)
+        uncovered &= ~primes[prime]
+    return cover
+
+
+def cover_heuristic(n, on):
+    # Espresso-style: seeds a cube on an uncovered row and expands it by
+    # dropping whichever literal gains the most uncovered rows while it stays
+    # inside the on-set, then removes cubes the others make redundant
+    vectors, full = bit_vectors(n, packed=False)
+    cover = {}
+    uncovered = on
+    while uncovered:
+        row = (uncovered & -uncovered).bit_length() - 1
+        value, care = row, (1 << n) - 1
+        rows = cube_rows((value, care), vectors, full)
+        while True:
+            best = None
+            for i in range(n):
+                if care >> i & 1:
+                    candidate = (value & ~(1 << i), care & ~(1 << i))
+                    expanded = cube_rows(candidate, vectors, full)
+                    if expanded & ~on == 0:
+                        gain = (expanded & uncovered).bit_count()
+                        if best is None or gain > best[0]:
+                            best = (gain, candidate, expanded)
+            if best is None:
+                break
+            _, (value, care), rows = best
+        cover[(value, care)] = rows
+        uncovered &= ~rows
+
+    for cube in sorted(cover, key=lambda cube: cover[cube].bit_count()):
+        others = 0
+        for other, rows in cover.items():
+            if other != cube:
+                others |= rows
+        if cover[cube] & ~others == 0:
+            del cover[cube]
+    return list(cover)
+
+
+def minimize(term, exact=None):
+    # Two-level (sum of products) form of term over its inputs, exact up to
+    # EXACT_INPUTS inputs unless exact says otherwise. Terms with more than
+    # TWO_LEVEL_INPUTS inputs are refused.
+    names = sorted(variable.name for variable in term.inputs())
+    if len(names) > TWO_LEVEL_INPUTS:
+        raise ValueError(f"{len(names)} inputs is more than the "
+                         f"{TWO_LEVEL_INPUTS} two-level minimization handles")
+    on = term.truth_table(names)
+    if exact is None:
+        exact = len(names) <= EXACT_INPUTS
+    cover = (cover_exact if exact else cover_heuristic)(len(names), on)
+
+    products = []
+    for value, care in sorted(cover):
+        literals = []
+        for i, name in enumerate(names):
+            if care >> i & 1:
+                literal = Variable(name)
+                literals.append(literal if value >> i & 1 else Not(literal))
+        product = literals[0] if literals else Constant(True)
+        for literal in literals[1:]:
+            product = And(product, literal)
+        products.append(product)
+    if not products:
+        return Constant(False)
+    result = products[0]
+    for product in products[1:]:
+        result = Or(result, product)
+    return result
+
+
+def two_level(term, index, exact=None, stats=None):
+    if len(term.inputs()) > TWO_LEVEL_INPUTS:
+        return term
+    result = minimize(term, exact)
+    if result.cost() >= term.cost():
+        return term
+    if stats is not None:
+        stats.improve(result, result.cost())
+    return result
+
+
+# Strategies a portfolio races by default, as (engine, options) pairs. With
+# fewer workers than strategies they start in this order, fastest first.
+PORTFOLIO = (
+    ("two-level", {}),
+    ("greedy", {"ac": True}),
+    ("egraph", {}),
+    ("best-first", {"ac": True, "seed": 1}),
+    ("best-first", {"seed": 2}),
+)
+
+# Seconds a portfolio runs by default. Greedy and runs that never fall
+# behind need not stop on their own, so without a deadline a portfolio may
+# not return.
+PORTFOLIO_TIMEOUT = 10.0
+
+
+class Beaten(Exception):
+    pass
+
+
+class Race(Stats):
+    # Stats of one portfolio run, starting from a term of cost. Improvements
+    # are published to the other runs, and the run gives up once one of them
+    # has reached bound, or after patience expansions without an improvement
+    # while another run is ahead.
+    whole = True
+
+    def __init__(self, number, best, queue, bound, patience, cost):
+        super().__init__()
+        self.number = number
+        self.best = best
+        self.queue = queue
+        self.bound = bound
+        self.patience = patience
+        self.cost = cost
+        self.stalled = 0
+
+    def improve(self, term, cost):
+        # Only the cost of a published term is shared, so a run that is
+        # ahead always has a result to show for it
+        self.cost = term.cost()
+        self.stalled = 0
+        self.queue.put(("improved", self.number, term.encode()))
+        with self.best.get_lock():
+            if self.cost < self.best.value:
+                self.best.value = self.cost
+
+    def expand(self, frontier, explored):
+        super().expand(frontier, explored)
+        self.stalled += 1
+        if self.best.value <= self.bound:
+            raise Beaten()
+        if (self.patience is not None and self.stalled > self.patience and
+                self.best.value < self.cost):
+            raise Beaten()
+
+
+def race(number, encoding, rules, engine, options, best, queue, bound,
+         patience):
+    # Worker side of portfolio()
+    term = decode(encoding)
+    stats = Race(number, best, queue, bound, patience, term.cost())
+    try:
+        result = term.simplify(rules, engine, stats=stats, **options)
+        stats.improve(result, result.cost())
+    except Beaten:
+        pass
+    finally:
+        queue.put(("done", number, None))
+
+
+def lower_bound(term, vectors=SIMULATION_VECTORS, seed=0):
+    # A cost no equivalent term can go below: each input the function is
+    # seen to depend on on random vectors is a leaf, joined by binary gates
+    names = sorted(variable.name for variable in term.inputs())
+    generator = Random(seed)
+    values = {name: generator.getrandbits(vectors) for name in names}
+    full = (1 << vectors) - 1
+    output = term.simulate(values, full)
+    relevant = 0
+    for name in names:
+        flipped = dict(values)
+        flipped[name] ^= full
+        if term.simulate(flipped, full) != output:
+            relevant += 1
+    return max(1, 2 * relevant - 1)
+
+
+def portfolio(term, index, strategies=PORTFOLIO, timeout=PORTFOLIO_TIMEOUT,
+              workers=None, patience=1000, stats=None):
+    # Races strategies, (engine, options) pairs, on term in parallel worker
+    # processes, at most workers at a time, and returns the cheapest result.
+    # Runs share the best cost found so far: all of them stop once it
+    # reaches lower_bound(term), and a run that is behind stops after
+    # patience expansions without improving. After timeout seconds the runs
+    # still going are terminated, which a process pool could not do, and
+    # the best term reported by then is returned; None waits for all runs.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    deadline = None if timeout is None else monotonic() + timeout
+    best = multiprocessing.Value("q", term.cost())
+    queue = multiprocessing.Queue()
+    bound = lower_bound(term)
+    encoding = term.encode()
+    result = term
+    pending = list(enumerate(strategies))
+    running = {}
+
+    def receive(message, number, found):
+        nonlocal result
+        if message == "done":
+            running.pop(number).join()
+        elif decode(found).cost() < result.cost():
+            result = decode(found)
+            if stats is not None:
+                stats.improve(result, result.cost())
+
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                number, (engine, options) = pending.pop(0)
+                process = multiprocessing.Process(
+                    target=race, daemon=True,
+                    args=(number, encoding, index.rules, engine, options,
+                          best, queue, bound, patience))
+                process.start()
+                running[number] = process
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                receive(*queue.get(timeout=remaining))
+            except Empty:
+                break
+        # Improvements sent before the deadline but not read yet
+        while True:
+            try:
+                receive(*queue.get_nowait())
+            except Empty:
+                break
+    finally:
+        for process in running.values():
+            process.terminate()
+            process.join()
+    return result
+
+
+ENGINES = {
+    "greedy": greedy,
+    "egraph": saturate,
+    "best-first": best_first,
+    "two-level": two_level,
+    "portfolio": portfolio,
+}
+
+
+def variable_order(terms, heuristic="dfs"):
+    # Input names of terms in a BDD variable order. "dfs" takes them in
+    # order of first appearance, which keeps related inputs together,
+    # "frequency" puts the inputs with the most distinct parents first and
+    # "name" sorts them.
+    if heuristic == "name":
+        return sorted({variable.name for term in terms
+                       for variable in term.inputs()})
+    uses = {}
+    for term in terms:
+        for subterm in term.postorder():
+            if isinstance(subterm, Variable):
+                uses.setdefault(subterm.name, 0)
+            for child in subterm.children:
+                if isinstance(child, Variable):
+                    uses[child.name] += 1
+    if heuristic == "dfs":
+        return list(uses)
+    if heuristic == "frequency":
+        return sorted(uses, key=lambda name: -uses[name])
+    raise ValueError(f"unknown variable order {heuristic!r}")
+
+
+class BDD:
+    # Reduced ordered binary decision diagrams over a fixed variable order,
+    # all sharing one unique table so equal functions are the same node.
+    # Nodes are integers indexing self.nodes, whose entries are (level, low,
+    # high); 0 and 1 are the terminals and sit below every level.
+    def __init__(self, order):
+        self.order = list(order)
+        self.levels = {name: level for level, name in enumerate(self.order)}
+        bottom = len(self.order)
+        self.nodes = [(bottom, 0, 0), (bottom, 1, 1)]
+        self.unique = {}
+        self.computed = {}
+
+    def node(self, level, low, high):
+        if low == high:
+            return low
+        key = (level, low, high)
+        node = self.unique.get(key)
+        if node is None:
+            node = self.unique[key] = len(self.nodes)
+            self.nodes.append(key)
+        return node
+
+    def variable(self, name):
+        return self.node(self.levels[name], 0, 1)
+
+    def trivial(self, f, g, h):
+        # ite(f, g, h) when it needs no recursion, else None
+        if f == 1:
+            return g
+        if f == 0:
+            return h
+        if g == h:
+            return g
+        if g == 1 and h == 0:
+            return f
+        return None
+
+    def ite(self, f, g, h):
+        # if f then g else h. Cofactors are computed with an explicit stack,
+        # which is one entry deep per level, like the traversals below.
+        result = self.trivial(f, g, h)
+        if result is not None:
+            return result
+        nodes = self.nodes
+        computed = self.computed
+        root = (f, g, h)
+        stack = [root]
+        while stack:
+            key = stack[-1]
+            if key in computed:
+                stack.pop()
+                continue
+            f, g, h = key
+            f_level, f_low, f_high = nodes[f]
+            g_level, g_low, g_high = nodes[g]
+            h_level, h_low, h_high = nodes[h]
+            level = min(f_level, g_level, h_level)
+            # The cofactors of each operand on the top level
+            if f_level != level:
+                f_low = f_high = f
+            if g_level != level:
+                g_low = g_high = g
+            if h_level != level:
+                h_low = h_high = h
+            low = self.trivial(f_low, g_low, h_low)
+            if low is None:
+                low = computed.get((f_low, g_low, h_low))
+                if low is None:
+                    stack.append((f_low, g_low, h_low))
+            high = self.trivial(f_high, g_high, h_high)
+            if high is None:
+                high = computed.get((f_high, g_high, h_high))
+                if high is None:
+                    stack.append((f_high, g_high, h_high))
+            if low is None or high is None:
+                continue
+            stack.pop()
+            computed[key] = self.node(level, low, high)
+        return computed[root]
+
+    def build(self, term):
+        nodes = {}
+        for subterm in term.postorder():
+            args = [nodes[child] for child in subterm.children]
+            if isinstance(subterm, Constant):
+                nodes[subterm] = int(subterm.value)
+            elif isinstance(subterm, Variable):
+                nodes[subterm] = self.variable(subterm.name)
+            elif isinstance(subterm, Not):
+                nodes[subterm] = self.ite(args[0], 0, 1)
+            elif isinstance(subterm, And):
+                nodes[subterm] = self.ite(args[0], args[1], 0)
+            else:
+                nodes[subterm] = self.ite(args[0], 1, args[1])
+        return nodes[term]
+
+    def count(self, f):
+        # Number of assignments to all variables in the order satisfying f
+        counts = {0: 0, 1: 1}
+        stack = [f]
+        while stack:
+            node = stack[-1]
+            if node in counts:
+                stack.pop()
+                continue
+            level, low, high = self.nodes[node]
+            missing = [child for child in (low, high) if child not in counts]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            counts[node] = sum(counts[child] << (self.nodes[child][0] - level - 1)
+                               for child in (low, high))
+        return counts[f] << self.nodes[f][0]
+
+    def key(self, f):
+        # Digest of the function of f that does not depend on node numbering,
+        # so it can identify the function across managers with the same order
+        digest = blake2b(repr(self.order).encode(), digest_size=16)
+        numbers = {0: 0, 1: 1}
+        stack = [f]
+        while stack:
+            node = stack[-1]
+            if node in numbers:
+                stack.pop()
+                continue
+            level, low, high = self.nodes[node]
+            missing = [child for child in (low, high) if child not in numbers]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            numbers[node] = len(numbers)
+            digest.update(repr((level, numbers[low], numbers[high])).encode())
+        digest.update(repr(numbers[f]).encode())
+        return digest.hexdigest()
+
+    def satisfy(self, f):
+        # An assignment to every variable in the order satisfying f, or None
+        if f == 0:
+            return None
+        assignment = dict.fromkeys(self.order, False)
+        while f != 1:
+            level, low, high = self.nodes[f]
+            assignment[self.order[level]] = low == 0
+            f = high if low == 0 else low
+        return assignment
+
+
+def first_row(vector):
+    # Index of the lowest set bit of a bit vector, or None when it is zero
+    if isinstance(vector, int):
+        return (vector & -vector).bit_length() - 1 if vector else None
+    words = numpy.flatnonzero(vector)
+    if not len(words):
+        return None
+    word = int(vector[words[0]])
+    return int(words[0]) * 64 + (word & -word).bit_length() - 1
+
+
+def luby(i):
+    # i-th element (from 1) of the Luby restart sequence 1 1 2 1 1 2 4 ...
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+
+class Solver:
+    # CDCL SAT solver with two watched literals per clause, first-UIP clause
+    # learning, activity-ordered decisions with phase saving and Luby
+    # restarts. Variables are positive integers and a literal is a variable
+    # or its negation.
+    RESTART_CONFLICTS = 100
+
+    def __init__(self):
+        self.clauses = []
+        self.watches = {}
+        self.values = {}
+        self.levels = {}
+        self.reasons = {}
+        self.trail = []
+        self.limits = []
+        self.head = 0
+        self.activity = {}
+        self.phase = {}
+        self.bump = 1.0
+        self.queue = []
+        self.failed = False
+
+    def value(self, literal):
+        value = self.values.get(abs(literal))
+        if value is None or literal > 0:
+            return value
+        return not value
+
+    def add_variable(self, variable):
+        if variable not in self.activity:
+            self.activity[variable] = 0.0
+            self.watches[variable] = []
+            self.watches[-variable] = []
+            heappush(self.queue, (0.0, variable))
+
+    def add_clause(self, literals):
+        literals = list(dict.fromkeys(literals))
+        for literal in literals:
+            self.add_variable(abs(literal))
+        if any(-literal in literals for literal in literals):
+            return
+        if not literals:
+            self.failed = True
+        elif len(literals) == 1:
+            if self.value(literals[0]) is False:
+                self.failed = True
+            elif self.value(literals[0]) is None:
+                self.assign(literals[0], None)
+        else:
+            self.attach(literals)
+
+    def attach(self, clause):
+        self.clauses.append(clause)
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+
+    def assign(self, literal, reason):
+        self.values[abs(literal)] = literal > 0
+        self.levels[abs(literal)] = len(self.limits)
+        self.reasons[abs(literal)] = reason
+        self.trail.append(literal)
+
+    def propagate(self):
+        # Unit propagation; returns a conflicting clause or None. Clauses
+        # are watched on their first two literals and moved to the watch
+        # list of another literal when a watched one becomes false.
+        while self.head < len(self.trail):
+            false = -self.trail[self.head]
+            self.head += 1
+            watching = self.watches[false]
+            kept = []
+            for position, clause in enumerate(watching):
+                if clause[0] == false:
+                    clause[0], clause[1] = clause[1], clause[0]
+                if self.value(clause[0]) is True:
+                    kept.append(clause)
+                    continue
+                for i in range(2, len(clause)):
+                    if self.value(clause[i]) is not False:
+                        clause[1], clause[i] = clause[i], clause[1]
+                        self.watches[clause[1]].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if self.value(clause[0]) is False:
+                        kept.extend(watching[position + 1:])
+                        self.watches[false] = kept
+                        return clause
+                    self.assign(clause[0], clause)
+            self.watches[false] = kept
+        return None
+
+    def analyze(self, conflict):
+        # First-UIP learnt clause, asserting literal first and the literal of
+        # the highest remaining level second, and the level to backjump to
+        level = len(self.limits)
+        seen = set()
+        learnt = [None]
+        pending = 0
+        index = len(self.trail) - 1
+        clause = conflict
+        literal = None
+        while True:
+            for other in (clause if literal is None else clause[1:]):
+                variable = abs(other)
+                if variable in seen or self.levels[variable] == 0:
+                    continue
+                seen.add(variable)
+                self.activity[variable] += self.bump
+                heappush(self.queue, (-self.activity[variable], variable))
+                if self.levels[variable] == level:
+                    pending += 1
+                else:
+                    learnt.append(other)
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            literal = self.trail[index]
+            index -= 1
+            pending -= 1
+            if pending == 0:
+                break
+            clause = self.reasons[abs(literal)]
+        learnt[0] = -literal
+        if len(learnt) == 1:
+            return learnt, 0
+        highest = max(range(1, len(learnt)),
+                      key=lambda i: self.levels[abs(learnt[i])])
+        learnt[1], learnt[highest] = learnt[highest], learnt[1]
+        return learnt, self.levels[abs(learnt[1])]
+
+    def backtrack(self, level):
+        if len(self.limits) <= level:
+            return
+        for literal in self.trail[self.limits[level]:]:
+            variable = abs(literal)
+            self.phase[variable] = self.values.pop(variable)
+            del self.levels[variable]
+            del self.reasons[variable]
+            heappush(self.queue, (-self.activity[variable], variable))
+        del self.trail[self.limits[level]:]
+        del self.limits[level:]
+        self.head = len(self.trail)
+
+    def decide(self):
+        while self.queue:
+            _, variable = heappop(self.queue)
+            if variable not in self.values:
+                return variable if self.phase.get(variable) else -variable
+        return None
+
+    def solve(self):
+        # A satisfying assignment {variable: value}, or None if there is none
+        if self.failed:
+            return None
+        conflicts = 0
+        restarts = 1
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                if not self.limits:
+                    return None
+                conflicts += 1
+                learnt, level = self.analyze(conflict)
+                self.backtrack(level)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.attach(learnt)
+                    self.assign(learnt[0], learnt)
+                self.bump *= 1.05
+                if self.bump > 1e100:
+                    for variable in self.activity:
+                        self.activity[variable] *= 1e-100
+                    self.bump *= 1e-100
+                    self.queue = [(-activity, variable) for variable, activity
+                                  in self.activity.items()]
+                    heapify(self.queue)
+                continue
+            if conflicts >= self.RESTART_CONFLICTS * luby(restarts):
+                conflicts = 0
+                restarts += 1
+                self.backtrack(0)
+                continue
+            literal = self.decide()
+            if literal is None:
+                return dict(self.values)
+            self.limits.append(len(self.trail))
+            self.assign(literal, None)
+
+
+def miter(a, b):
+    # Tseitin-encodes "a differs from b" and solves it: returns an input
+    # assignment on which they differ, or None when they are equivalent
+    solver = Solver()
+    literals = {}
+    for term in Or(a, b).postorder():
+        literals[term] = len(literals) + 1
+        args = [literals[child] for child in term.children]
+        for clause in term.clauses(literals[term], args):
+            solver.add_clause(clause)
+    solver.add_clause([literals[a], literals[b]])
+    solver.add_clause([-literals[a], -literals[b]])
+    model = solver.solve()
+    if model is None:
+        return None
+    return {term.name: model.get(literal, False)
+            for term, literal in literals.items()
+            if isinstance(term, Variable)}
+
+
+# Bit patterns of the first six variables inside one 64-row word
+_WORD_PATTERNS = (
+    0xAAAAAAAAAAAAAAAA, 0xCCCCCCCCCCCCCCCC, 0xF0F0F0F0F0F0F0F0,
+    0xFF00FF00FF00FF00, 0xFFFF0000FFFF0000, 0xFFFFFFFF00000000,
+)
+
+
+@lru_cache(maxsize=8)
+def bit_vectors(n, packed=None):
+    # Returns one bit vector per variable plus the all-rows mask. Row r of
+    # the truth table assigns variable i the value of bit i of r. The
+    # vectors are shared between callers and must not be modified in place.
+    if packed is None:
+        packed = numpy is not None and n > PACKED_INPUTS
+    if packed:
+        words = 1 << max(n - 6, 0)
+        ones = numpy.uint64(0xFFFFFFFFFFFFFFFF)
+        index = numpy.arange(words, dtype=numpy.uint64)
+        vectors = []
+        for i in range(n):
+            if i < 6:
+                vector = numpy.full(words, _WORD_PATTERNS[i], dtype=numpy.uint64)
+            else:
+                bit = (index >> numpy.uint64(i - 6)) & numpy.uint64(1)
+                vector = bit * ones
+            vectors.append(vector)
+        full = numpy.full(words, ones, dtype=numpy.uint64)
+        if n < 6:
+            full &= numpy.uint64((1 << (1 << n)) - 1)
+            vectors = [vector & full for vector in vectors]
+        return tuple(vectors), full
+
+    rows = 1 << n
+    vectors = []
+    for i in range(n):
+        width = 1 << i
+        vector = ((1 << width) - 1) << width
+        period = width << 1
+        while period < rows:
+            vector |= vector << period
+            period <<= 1
+        vectors.append(vector)
+    return tuple(vectors), (1 << rows) - 1
+
+
+# Library truth tables have LIBRARY_INPUTS inputs, numbered like the rows of
+# bit_vectors(). Functions that differ only by the order of their inputs
+# have circuits of the same cost, so only the smallest truth table of each
+# such class is stored and the others are found by renaming its inputs.
+# Negating inputs or outputs costs gates, unlike in NPN classification.
+LIBRARY_MAGIC = b"GATES4\x01"
+LIBRARY_RECORD = struct.Struct("<HBHH")
+LIBRARY_VARIABLE, LIBRARY_CONSTANT = 1, 2
+_LIBRARY = None
+
+
+@lru_cache(maxsize=None)
+def input_permutations():
+    # Each ordering of the inputs with, for every row, the row it reads
+    found = []
+    for order in permutations(range(LIBRARY_INPUTS)):
+        source = tuple(sum(1 << order[i] for i in range(LIBRARY_INPUTS)
+                           if row >> i & 1)
+                       for row in range(1 << LIBRARY_INPUTS))
+        found.append((order, source))
+    return found
+
+
+def permute(table, source):
+    result = 0
+    for row, read in enumerate(source):
+        result |= (table >> read & 1) << row
+    return result
+
+
+def optimal_circuits():
+    # Minimum-cost circuits of every function of LIBRARY_INPUTS inputs, as a
+    # dict from truth table to (opcode, first, second): the truth tables of
+    # the children of And and Or, the child of Not, the input of a variable
+    # or the value of a constant. Builds them cheapest first, closing every
+    # new function under input permutations, and takes about half a minute.
+    vectors, full = bit_vectors(LIBRARY_INPUTS, packed=False)
+    sources = [source for _, source in input_permutations()]
+    best = {}
+    for i, vector in enumerate(vectors):
+        best[vector] = (LIBRARY_VARIABLE, i, 0)
+    best[0] = (LIBRARY_CONSTANT, 0, 0)
+    best[full] = (LIBRARY_CONSTANT, 1, 0)
+    # Functions by cost, and the smallest truth table of each class
+    levels = [[], list(best)]
+    representatives = [[], [min(vectors), 0, full]]
+
+    def found(table, entry):
+        images = []
+        for source in sources:
+            image = permute(table, source)
+            if image not in best:
+                best[image] = (entry[0], permute(entry[1], source),
+                               permute(entry[2], source))
+                levels[-1].append(image)
+            images.append(image)
+        representatives[-1].append(min(images))
+
+    while len(best) < 1 << (1 << LIBRARY_INPUTS):
+        cost = len(levels)
+        levels.append([])
+        representatives.append([])
+        for child in levels[cost - 1]:
+            if full ^ child not in best:
+                found(full ^ child, (OPCODES[Not], child, 0))
+        for left in range(1, cost - 1):
+            right = cost - 1 - left
+            for second in representatives[right]:
+                for cls, combine in ((And, second.__and__),
+                                     (Or, second.__or__)):
+                    # Only a rare pair builds something new, so they are
+                    # looked for once it is known there is one
+                    if not set(map(combine, levels[left])).difference(best):
+                        continue
+                    for first in levels[left]:
+                        if combine(first) not in best:
+                            found(combine(first), (OPCODES[cls], first,
+                                                   second))
+    return best
+
+
+def write_library(path=LIBRARY_PATH, circuits=None):
+    if circuits is None:
+        circuits = optimal_circuits()
+    representatives = sorted({min(permute(table, source)
+                                  for _, source in input_permutations())
+                              for table in circuits})
+    with open(path, "wb") as file:
+        file.write(LIBRARY_MAGIC)
+        for table in representatives:
+            file.write(LIBRARY_RECORD.pack(table, *circuits[table]))
+
+
+def library():
+    # The stored circuits by truth table, read on first use
+    global _LIBRARY
+    if _LIBRARY is None:
+        with open(LIBRARY_PATH, "rb") as file:
+            data = file.read()
+        if not data.startswith(LIBRARY_MAGIC):
+            raise ValueError(f"{LIBRARY_PATH} is not a circuit library")
+        entries = {}
+        for record in LIBRARY_RECORD.iter_unpack(data[len(LIBRARY_MAGIC):]):
+            entries[record[0]] = record[1:]
+        _LIBRARY = entries
+    return _LIBRARY
+
+
+@lru_cache(maxsize=None)
+def library_circuit(table):
+    # Optimal circuit for a truth table over inputs x0, x1, ...
+    entries = library()
+    for order, source in input_permutations():
+        stored = permute(table, source)
+        if stored in entries:
+            break
+    opcode, first, second = entries[stored]
+    if opcode == LIBRARY_VARIABLE:
+        circuit = Variable(f"x{first}")
+    elif opcode == LIBRARY_CONSTANT:
+        circuit = Constant(first)
+    elif CLASSES[opcode] is Not:
+        circuit = Not(library_circuit(first))
+    else:
+        circuit = CLASSES[opcode](library_circuit(first),
+                                  library_circuit(second))
+    if stored == table:
+        return circuit
+    # The stored function reads input order[i] where this one reads input i
+    return circuit.substitute({f"x{i}": Variable(f"x{order[i]}")
+                               for i in range(LIBRARY_INPUTS)})
+
+
+def optimal(term):
+    # A minimum-cost term equivalent to term from the library, or None when
+    # term has more than LIBRARY_INPUTS inputs
+    names = sorted(variable.name for variable in term.inputs())
+    if len(names) > LIBRARY_INPUTS:
+        return None
+    vectors, full = bit_vectors(LIBRARY_INPUTS, packed=False)
+    table = term.simulate(dict(zip(names, vectors)), full)
+    return library_circuit(table).substitute(
+        {f"x{i}": Variable(name) for i, name in enumerate(names)})
 
 
 RULES = {